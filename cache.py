@@ -0,0 +1,107 @@
+from collections import OrderedDict
+import time
+import asyncio
+
+
+class TTLCache:
+    """
+    簡單的 TTL + LRU 快取（單一 event loop 內使用，不需要鎖）。
+    超過 ttl 秒的項目視為不存在；超過 maxsize 時移除最久未使用的項目。
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()  # key → (到期時間, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return item[1] if item else default
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def snapshot(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_sec": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    相同 key 的並行請求共用同一個執行中的 task。
+    所有等待者都離開（例如 client 斷線被取消）時才取消該 task。
+    """
+
+    def __init__(self):
+        self._flights: dict = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key, factory):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight(asyncio.create_task(factory()))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _forget(self, key, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def snapshot(self) -> dict:
+        return {"in_flight": len(self._flights), "started": self.started, "coalesced": self.coalesced}
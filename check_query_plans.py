@@ -0,0 +1,105 @@
+"""
+檢查 admin 篩選 / 訂單歷史查詢是否都能走索引。
+
+對每一種篩選組合實際產生 endpoint 會送出的 SQL，在關閉 seq scan 的 transaction 中取得 EXPLAIN。
+enable_seqscan=off 只是讓 planner 盡量避免 seq scan：如果仍然出現 Seq Scan，代表沒有可用的索引，
+因此結果與資料量無關，空的開發 DB 也能檢查。
+
+    python check_query_plans.py          # 有任何組合退化成 Seq Scan 時 exit code 1
+    python check_query_plans.py -v       # 同時印出每個查詢的 plan
+"""
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text, tuple_
+from database import SessionLocal
+from models import Order, User
+from schemas import OrderListRq, UserListRq
+from routers.api_v1.endpoints.admin import order_filters, user_filters, ORDER_PAGE_ORDER, USER_PAGE_ORDER
+import sys
+import json
+
+PAGE_SIZE = 10
+now = datetime.now(timezone.utc)
+last_week = now - timedelta(days=7)
+
+# admin UI 實際使用的篩選組合
+# contains 篩選的字串至少 3 個字：少於 3 個字元 pg_trgm 取不到 trigram，本來就不會使用 GIN 索引
+ORDER_CASES = {
+    "orders: 無篩選": OrderListRq(),
+    "orders: status": OrderListRq(status=[3, 4]),
+    "orders: status + 日期": OrderListRq(status=[3, 4], start_date=last_week, end_date=now),
+    "orders: user_id": OrderListRq(user_id=1),
+    "orders: user_id + 日期": OrderListRq(user_id=1, start_date=last_week, end_date=now),
+    "orders: driver_id": OrderListRq(driver_id=1),
+    "orders: pickup_name": OrderListRq(pickup_name="台中車站"),
+    "orders: dropoff_name": OrderListRq(dropoff_name="台中車站"),
+}
+USER_CASES = {
+    "users: 無篩選": UserListRq(),
+    "users: name": UserListRq(username="王小明"),
+    "users: email": UserListRq(email="example"),
+    "users: phone": UserListRq(phone="0912"),
+}
+
+
+def seq_scans(plan: dict) -> list[str]:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name", "?"))
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def explain(db, query) -> dict:
+    # render_postcompile：展開 IN (...) 參數，否則 SQL 中會留下 __[POSTCOMPILE_...] 佔位字串
+    compiled = query.statement.compile(dialect=db.bind.dialect, compile_kwargs={"render_postcompile": True})
+    plan = db.connection().exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def build_queries(db) -> dict:
+    queries = {}
+    for name, payload in ORDER_CASES.items():
+        base = db.query(Order).filter(*order_filters(payload))
+        queries[name] = base.order_by(*ORDER_PAGE_ORDER).limit(PAGE_SIZE + 1)
+        queries[name + " (cursor)"] = (
+            base.filter(tuple_(Order.created_at, Order.order_id) < tuple_(now, "~"))
+            .order_by(*ORDER_PAGE_ORDER).limit(PAGE_SIZE + 1)
+        )
+    for name, payload in USER_CASES.items():
+        base = db.query(User).filter(*user_filters(payload))
+        queries[name] = base.order_by(*USER_PAGE_ORDER).limit(PAGE_SIZE + 1)
+
+    # /order/history
+    queries["history: user_id (cursor)"] = (
+        db.query(Order)
+        .filter(Order.user_id == 1, tuple_(Order.created_at, Order.order_id) < tuple_(now, "~"))
+        .order_by(*ORDER_PAGE_ORDER).limit(PAGE_SIZE + 1)
+    )
+    return queries
+
+
+def main(verbose: bool = False) -> int:
+    failed = []
+    with SessionLocal() as db:
+        db.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, query in build_queries(db).items():
+            plan = explain(db, query)
+            scans = seq_scans(plan)
+            print(f"{'FAIL' if scans else 'ok  '}  {name}" + (f"  (Seq Scan on {', '.join(scans)})" if scans else ""))
+            if verbose:
+                print(json.dumps(plan, indent=2, ensure_ascii=False))
+            if scans:
+                failed.append(name)
+        db.rollback()
+
+    if failed:
+        print(f"\n{len(failed)} 個查詢沒有可用的索引")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(verbose="-v" in sys.argv))
@@ -0,0 +1,166 @@
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+import multiprocessing
+import asyncio
+import os
+import time
+import threading
+
+# bcrypt cost，調高後舊 hash 會在使用者下次登入時重新 hash
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", "16"))      # workers 都在忙時最多再排隊幾個，超過直接 503
+HASH_TIMEOUT_SEC = float(os.getenv("HASH_TIMEOUT_SEC", "10"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+# ----------------------------
+# 在 worker process 中執行
+# ----------------------------
+def _hash(password: str):
+    started = time.perf_counter()
+    return pwd_context.hash(password), time.perf_counter() - started
+
+
+def _verify_and_update(password: str, password_hash: str):
+    started = time.perf_counter()
+    return pwd_context.verify_and_update(password, password_hash), time.perf_counter() - started
+
+
+class _OpStats:
+    __slots__ = ("count", "total_wait", "max_wait", "total_service", "max_service")
+
+    def __init__(self):
+        self.count = 0
+        self.total_wait = 0.0      # 排隊等 worker 的時間
+        self.max_wait = 0.0
+        self.total_service = 0.0   # bcrypt 本身的時間
+        self.max_service = 0.0
+
+    def record(self, wait: float, service: float):
+        self.count += 1
+        self.total_wait += wait
+        self.total_service += service
+        self.max_wait = max(self.max_wait, wait)
+        self.max_service = max(self.max_service, service)
+
+    def snapshot(self) -> dict:
+        n = self.count or 1
+        return {
+            "count": self.count,
+            "avg_wait_ms": round(self.total_wait / n * 1000, 3),
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "avg_service_ms": round(self.total_service / n * 1000, 3),
+            "max_service_ms": round(self.max_service * 1000, 3),
+        }
+
+
+class PasswordHasher:
+    """
+    bcrypt 專用的 process pool。
+    - async endpoint 直接 await worker 的結果，等待期間不佔用 threadpool 的 thread
+    - 最多 workers + queue_size 個 hash 同時在 pool 中，其餘立即回 503；
+      名額在 worker 真正做完（或排隊中被取消）時才歸還，逾時的請求不會讓 pool 裡的工作越積越多
+    - worker 以 spawn 啟動，不 fork 帶有 event loop / DB 連線的主 process
+    - 記錄排隊時間、bcrypt 執行時間與被拒絕次數
+    """
+
+    def __init__(self, workers: int = HASH_WORKERS, queue_size: int = HASH_QUEUE_SIZE, timeout: float = HASH_TIMEOUT_SEC):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.inflight = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.stats = {"hash": _OpStats(), "verify": _OpStats()}
+        self._lock = threading.Lock()     # inflight 也會在 pool 的 callback thread 中更新
+        self._executor: ProcessPoolExecutor | None = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    )
+        return self._executor
+
+    def _release(self, _future):
+        with self._lock:
+            self.inflight -= 1
+
+    async def _run(self, op: str, fn, *args):
+        with self._lock:
+            busy = self.inflight >= self.workers + self.queue_size
+            if busy:
+                self.rejected += 1
+            else:
+                self.inflight += 1
+        if busy:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Password service busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+
+        submitted = time.monotonic()
+        try:
+            future = self._pool().submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            # 逾時會取消還在排隊的工作；已在執行的做完後才由 _release 歸還名額
+            result, service = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Password service timeout",
+                headers={"Retry-After": "1"},
+            )
+
+        with self._lock:
+            self.stats[op].record(max(time.monotonic() - submitted - service, 0.0), service)
+        return result
+
+    # ----------------------------
+    # 對外 API（async endpoint await）
+    # ----------------------------
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        ok, _ = await self._run("verify", _verify_and_update, password, password_hash)
+        return ok
+
+    async def verify_and_update(self, password: str, password_hash: str) -> tuple[bool, str | None]:
+        """驗證成功且 hash 的 cost 與目前設定不同時，第二個值為新的 hash"""
+        ok, new_hash = await self._run("verify", _verify_and_update, password, password_hash)
+        if new_hash:
+            with self._lock:
+                self.rehashed += 1
+        return ok, new_hash
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "rounds": BCRYPT_ROUNDS,
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "inflight": self.inflight,
+                "queued": max(self.inflight - self.workers, 0),
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                **{op: s.snapshot() for op, s in self.stats.items()},
+            }
+
+
+password_hasher = PasswordHasher()
@@ -1,10 +1,11 @@
-from fastapi import FastAPI, WebSocket, Depends
-from database import get_db
+from fastapi import FastAPI, WebSocket
 from routers.api_v1.routers import router
 from models import Base
 from database import engine
 from fastapi.middleware.cors import CORSMiddleware
 from ws_modules.global_ws import server_ws, manager
+from hashing import password_hasher
+from place_index import place_index
 from config.logging_config import setup_logging
 import uvicorn
 import logging
@@ -20,11 +21,16 @@ setup_logging()
 # ----------------------
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    try:
+        await place_index.load()
+    except Exception as e:
+        print("載入 place index 失敗:", e)
     await manager.start_background_tasks()
     try:
         yield
     finally:
         await manager.stop_background_tasks()
+        password_hasher.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -39,6 +45,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Has-More", "X-Next-Cursor"],  # /order/history 分頁
 )
 
 app.include_router(router, prefix="/api/v1")
@@ -47,13 +54,13 @@ app.include_router(router, prefix="/api/v1")
 # WebSocket
 # ----------------------
 @app.websocket("/ws")
-async def ws_route(websocket: WebSocket, db=Depends(get_db)):
+async def ws_route(websocket: WebSocket):
     client_type = websocket.query_params.get("client_type", "unknown").lower()
 
     if client_type == "web":
-        await server_ws.websocket_endpoint_web(websocket, db=db)
+        await server_ws.websocket_endpoint_web(websocket)
     elif client_type == "flutter":
-        await server_ws.websocket_endpoint_flutter(websocket, db=db)
+        await server_ws.websocket_endpoint_flutter(websocket)
     elif client_type == "ros":
         await server_ws.websocket_endpoint_ros(websocket)
     else:
@@ -0,0 +1,53 @@
+"""
+一次性的 schema 調整（部署新版前執行一次，重複執行無影響）。
+
+create_all 只會建立不存在的 table（連同索引），既有 table 的欄位限制與 model 新增的索引需要在這裡補上。
+索引以 CREATE INDEX CONCURRENTLY 建立，不鎖住寫入，可以在服務運行中執行。
+
+    python migrate.py
+"""
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+from database import engine
+from models import Base
+
+
+def backfill_order_created_at(conn):
+    """orders.created_at 是 keyset 分頁的排序鍵：NULL 以 updated_at 補值後設為 NOT NULL"""
+    result = conn.execute(text("UPDATE orders SET created_at = COALESCE(updated_at, now()) WHERE created_at IS NULL"))
+    print(f"orders.created_at 補值 {result.rowcount} 筆")
+    conn.execute(text("ALTER TABLE orders ALTER COLUMN created_at SET DEFAULT now()"))
+    conn.execute(text("ALTER TABLE orders ALTER COLUMN created_at SET NOT NULL"))
+
+
+def create_missing_indexes(conn):
+    """
+    補上 model 中定義但 DB 還沒有的索引（CONCURRENTLY 不能在 transaction 中執行，conn 需為 autocommit）。
+    先前中斷的 CONCURRENTLY 會留下 INVALID 索引，IF NOT EXISTS 會略過它，因此先刪除再重建。
+    """
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    invalid = set(conn.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+    )).scalars())
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in invalid:
+                print(f"重建 INVALID 索引 {index.name}")
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+            # 只在這裡開啟 postgresql_concurrently：main.py 的 create_all 在 transaction 中執行，不能用 CONCURRENTLY
+            index.dialect_options["postgresql"]["concurrently"] = True
+            conn.execute(CreateIndex(index, if_not_exists=True))
+            print(f"索引 {index.name} ok")
+
+
+def main():
+    with engine.begin() as conn:
+        backfill_order_created_at(conn)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        create_missing_indexes(conn)
+    print("migration 完成")
+
+
+if __name__ == "__main__":
+    main()
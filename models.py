@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, SmallInteger, Numeric, TIMESTAMP, Float, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, SmallInteger, Numeric, TIMESTAMP, Float, Boolean, Index, DDL, event
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from geoalchemy2 import Geometry
@@ -26,6 +26,13 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
+    # admin 用戶篩選的 contains（LIKE '%...%'）走 trigram 索引
+    __table_args__ = (
+        Index("ix_users_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_users_email_trgm", "email", postgresql_using="gin", postgresql_ops={"email": "gin_trgm_ops"}),
+        Index("ix_users_phone_trgm", "phone", postgresql_using="gin", postgresql_ops={"phone": "gin_trgm_ops"}),
+    )
+
 class Order(Base):
     __tablename__ = "orders"
 
@@ -46,7 +53,9 @@ class Order(Base):
     dropoff_name = Column(String(100), nullable=True)  # 下車地點名稱
 
     status = Column(SmallInteger, default=OrderStatus.PENDING.value, nullable=False)
-    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    # keyset 分頁的排序鍵，不可為 NULL（既有資料由 migrate.py 補值）
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc),
+                        server_default=func.now(), nullable=False)
     updated_at = Column(
         DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc),
@@ -58,6 +67,16 @@ class Order(Base):
     passengers = Column(Integer, nullable=False, default=1)  # 預設 1 個乘客
     accept_pooling = Column(Boolean, nullable=False, default=False)  # 預設不接受共乘
 
+    # admin 訂單篩選常用組合與 keyset 分頁 (created_at, order_id)
+    __table_args__ = (
+        Index("ix_orders_created_at_order_id", "created_at", "order_id"),
+        Index("ix_orders_status_created_at", "status", "created_at"),
+        Index("ix_orders_user_id_created_at", "user_id", "created_at", "order_id"),
+        Index("ix_orders_driver_id", "driver_id"),
+        Index("ix_orders_pickup_name_trgm", "pickup_name", postgresql_using="gin", postgresql_ops={"pickup_name": "gin_trgm_ops"}),
+        Index("ix_orders_dropoff_name_trgm", "dropoff_name", postgresql_using="gin", postgresql_ops={"dropoff_name": "gin_trgm_ops"}),
+    )
+
 class Driver(Base):
     __tablename__ = "drivers"
 
@@ -98,3 +117,23 @@ class Route(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(),
                         onupdate=func.now(), nullable=False)
+
+class TrajectoryPoint(Base):
+    """車輛軌跡（odom 降頻取樣後以 COPY 批次寫入，超過保留時間的資料定期刪除）"""
+    __tablename__ = "trajectory_points"
+
+    vehicle_name = Column(String(50), primary_key=True)
+    ts = Column(DateTime(timezone=True), primary_key=True)
+    lat = Column(Float, nullable=False)
+    lng = Column(Float, nullable=False)
+    yaw = Column(Float, nullable=True)
+
+    # 主鍵 (vehicle_name, ts) 供單車時間區間查詢；資料依時間附加寫入，刪除過期資料用 BRIN 即可
+    __table_args__ = (
+        Index("ix_trajectory_points_ts_brin", "ts", postgresql_using="brin"),
+    )
+
+
+# trigram 索引需要 pg_trgm
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
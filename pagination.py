@@ -0,0 +1,59 @@
+from datetime import datetime
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Query
+import json
+import base64
+
+
+def encode_cursor(*values) -> str:
+    """把排序鍵編成不透明的 cursor 字串"""
+    raw = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(raw, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types) -> list:
+    """
+    解回排序鍵，types 為各欄位型別 (datetime / int / str)。
+    格式不符時回 400。
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(raw, list) or len(raw) != len(types):
+            raise ValueError
+        return [datetime.fromisoformat(v) if t is datetime else t(v) for v, t in zip(raw, types)]
+    except (ValueError, TypeError, json.JSONDecodeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def fetch_page(query: Query, size: int) -> tuple[list, bool]:
+    """多取一筆判斷是否還有下一頁，回傳 (rows, has_more)"""
+    rows = query.limit(size + 1).all()
+    return rows[:size], len(rows) > size
+
+
+def count_total(query: Query, mode: str) -> int | None:
+    """
+    exact    : COUNT(*)，篩選條件多、資料量大時較慢
+    estimate : Postgres planner 的估計筆數 (EXPLAIN)，不掃表
+    none     : 不計算
+    """
+    if mode == "exact":
+        return query.order_by(None).count()
+    if mode == "estimate":
+        return estimate_count(query)
+    return None
+
+
+def estimate_count(query: Query) -> int:
+    """以 EXPLAIN 取得 planner 估計的筆數（依賴 ANALYZE 統計，誤差可能較大）"""
+    # render_postcompile：IN (...) 等參數要先展開，否則 SQL 中會留下 __[POSTCOMPILE_...] 佔位字串
+    compiled = query.order_by(None).statement.compile(
+        dialect=query.session.bind.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    plan = query.session.connection().exec_driver_sql(
+        "EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
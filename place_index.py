@@ -0,0 +1,140 @@
+from sqlalchemy import select, func, union_all
+from database import AsyncSessionLocal
+from models import Order
+import math
+import heapq
+import bisect
+
+DISTANCE_SCALE_KM = 5.0      # 距離每增加這麼多公里，分數扣 1（約等於次數少 e 倍）
+MAX_CANDIDATES = 1000        # 前綴很短時最多評分幾個候選（取次數最多的）
+KM_PER_DEG = 111.32
+
+
+def normalize(name: str) -> str:
+    return " ".join(name.split()).casefold()
+
+
+def _distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    dy = (lat2 - lat1) * KM_PER_DEG
+    dx = (lng2 - lng1) * KM_PER_DEG * math.cos(math.radians((lat1 + lat2) / 2))
+    return math.hypot(dx, dy)
+
+
+class Place:
+    """同名地點合併成一筆：次數與平均座標"""
+    __slots__ = ("name", "count", "lat", "lng", "weight")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.lat = 0.0
+        self.lng = 0.0
+        self.weight = 0.0   # log(1 + count)，排序用
+
+    def add(self, lat: float, lng: float, count: int = 1):
+        total = self.count + count
+        self.lat += (lat - self.lat) * count / total
+        self.lng += (lng - self.lng) * count / total
+        self.count = total
+        self.weight = math.log1p(total)
+
+
+class PlaceIndex:
+    """
+    上下車地點名稱的前綴索引（排序陣列 + bisect）。
+    啟動時從歷史訂單彙總載入，新訂單建立時即時加入，查詢不碰 DB。
+    排序分數 = log(1 + 次數) - 與呼叫者的距離 / DISTANCE_SCALE_KM
+
+    符合的名稱超過 MAX_CANDIDATES 個的前綴（很短、很常見），只評分其中次數最多的 MAX_CANDIDATES 個；
+    這份依次數排序的清單在第一次查詢時建立並快取，有地點加入時清掉相關前綴的快取。
+    """
+
+    def __init__(self):
+        self.keys: list[str] = []             # 正規化後的名稱，已排序
+        self.places: dict[str, Place] = {}    # 正規化名稱 → Place
+        self.popular: dict[str, list[Place]] = {}   # 前綴 → 次數最多的 MAX_CANDIDATES 個地點（依次數排序）
+        self.loaded = False
+
+    async def load(self):
+        pickup = select(Order.pickup_name.label("name"), Order.pickup_lat.label("lat"), Order.pickup_lng.label("lng")) \
+            .where(Order.pickup_name.isnot(None))
+        dropoff = select(Order.dropoff_name.label("name"), Order.dropoff_lat.label("lat"), Order.dropoff_lng.label("lng")) \
+            .where(Order.dropoff_name.isnot(None))
+        names = union_all(pickup, dropoff).subquery()
+        stmt = select(names.c.name, func.count(), func.avg(names.c.lat), func.avg(names.c.lng)).group_by(names.c.name)
+
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(stmt)).all()
+
+        places: dict[str, Place] = {}
+        for name, count, lat, lng in rows:
+            key = normalize(name)
+            if not key:
+                continue
+            place = places.get(key)
+            if place is None:
+                place = places[key] = Place(name.strip())
+            place.add(float(lat), float(lng), count)
+
+        self.places = places
+        self.keys = sorted(places)
+        self.popular = {}
+        self.loaded = True
+        print(f"place index 載入 {len(self.keys)} 個地點")
+
+    def add(self, name: str | None, lat: float, lng: float):
+        if not name:
+            return
+        key = normalize(name)
+        if not key:
+            return
+        place = self.places.get(key)
+        if place is None:
+            place = self.places[key] = Place(name.strip())
+            bisect.insort(self.keys, key)
+        place.add(lat, lng)
+        # 次數改變，包含此名稱的前綴需重新排序
+        for i in range(1, len(key) + 1):
+            self.popular.pop(key[:i], None)
+
+    def _candidates(self, key: str) -> list[Place]:
+        start = bisect.bisect_left(self.keys, key)
+        end = bisect.bisect_left(self.keys, key + "\U0010ffff", lo=start)
+        if end - start <= MAX_CANDIDATES:
+            return [self.places[k] for k in self.keys[start:end]]
+        # 先依次數排序再截斷，熱門地點不會因為名稱排在後面而被略過
+        top = self.popular.get(key)
+        if top is None:
+            places = self.places
+            top = self.popular[key] = heapq.nlargest(
+                MAX_CANDIDATES, (places[k] for k in self.keys[start:end]), key=lambda p: p.weight,
+            )
+        return top
+
+    def suggest(self, prefix: str, lat: float | None = None, lng: float | None = None, limit: int = 10) -> list[dict]:
+        candidates = self._candidates(normalize(prefix))
+
+        if lat is None or lng is None:
+            top = heapq.nlargest(limit, candidates, key=lambda p: p.weight)
+            return [{"name": p.name, "lat": p.lat, "lng": p.lng, "count": p.count} for p in top]
+
+        # 小範圍內 cos(lat) 視為常數，省去每個候選的三角函數
+        ky = KM_PER_DEG / DISTANCE_SCALE_KM
+        kx = ky * math.cos(math.radians(lat))
+        top = heapq.nlargest(
+            limit, candidates,
+            key=lambda p: p.weight - math.hypot((p.lat - lat) * ky, (p.lng - lng) * kx),
+        )
+        return [
+            {
+                "name": p.name, "lat": p.lat, "lng": p.lng, "count": p.count,
+                "distance_m": round(_distance_km(lat, lng, p.lat, p.lng) * 1000, 1),
+            }
+            for p in top
+        ]
+
+    def snapshot(self) -> dict:
+        return {"loaded": self.loaded, "places": len(self.keys), "popular_prefixes": len(self.popular)}
+
+
+place_index = PlaceIndex()
@@ -0,0 +1,84 @@
+"""
+路線座標的 encoded polyline 編解碼（Google Encoded Polyline Algorithm）。
+
+[{lat, lng}, ...] 以 1e-5 度（約 1.1 公尺）量化後只存與前一點的差值，再以 base64 風格的可見字元
+變長編碼。一般路線每點約 4~6 個字元，比 JSON 的 {"lat": ..., "lng": ...} 小 5~10 倍。
+
+ROS 傳來的 path / path1 / path2 在收到時就轉成 encoded 字串，之後推送給 web / flutter、
+route preview 回應、寫入 DB 都直接使用字串；只有寫入 PostGIS 時才由 ST_LineFromEncodedPolyline 解開。
+"""
+
+PRECISION = 5
+PATH_FORMAT = "polyline5"                   # 訊息中 path_format 欄位的值，client 依此解碼
+ROUTE_FIELDS = ("path", "path1", "path2")   # ROS 訊息中的路線欄位
+
+_FACTOR = 10 ** PRECISION
+
+
+def _encode_value(value: int, out: list):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode(points) -> str:
+    """[{lat, lng}, ...] → encoded polyline"""
+    out: list[str] = []
+    prev_lat = prev_lng = 0
+    for pt in points or ():
+        lat = round(pt["lat"] * _FACTOR)
+        lng = round(pt["lng"] * _FACTOR)
+        _encode_value(lat - prev_lat, out)
+        _encode_value(lng - prev_lng, out)
+        prev_lat, prev_lng = lat, lng
+    return "".join(out)
+
+
+def decode(encoded: str) -> list[dict]:
+    """encoded polyline → [{lat, lng}, ...]"""
+    points = []
+    index = lat = lng = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append({"lat": lat / _FACTOR, "lng": lng / _FACTOR})
+    return points
+
+
+def point_count(encoded: str | None) -> int:
+    """不解碼直接計算點數：每個數值以一個 < 0x20 的字元結尾，每點兩個數值"""
+    if not encoded:
+        return 0
+    return sum(1 for c in encoded if ord(c) - 63 < 0x20) // 2
+
+
+def encode_route_fields(message: dict) -> dict:
+    """
+    把 ROS 訊息中仍是座標陣列的路線欄位就地轉成 encoded 字串並標記 path_format。
+    ROS 已經送 encoded 字串（需為 precision 5）時不重複處理。
+    """
+    encoded = False
+    for field in ROUTE_FIELDS:
+        value = message.get(field)
+        if isinstance(value, list):
+            message[field] = encode(value)
+            encoded = True
+        elif isinstance(value, str):
+            encoded = True
+    if encoded:
+        message["path_format"] = PATH_FORMAT
+    return message
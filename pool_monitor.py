@@ -0,0 +1,131 @@
+from sqlalchemy import event
+from functools import lru_cache
+import os
+import sys
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger("app.db_pool")
+
+_PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+_SKIP_FILES = {os.path.abspath(__file__), os.path.join(_PROJECT_ROOT, "database.py")}
+CHECKOUT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+@lru_cache(maxsize=1024)
+def _is_project_frame(filename: str) -> bool:
+    path = os.path.abspath(filename)
+    return (
+        path.startswith(_PROJECT_ROOT)
+        and path not in _SKIP_FILES
+        and "site-packages" not in path
+    )
+
+
+def _call_site() -> tuple | None:
+    """
+    找出借出連線的專案程式位置（略過 SQLAlchemy / FastAPI 內部 frame）。
+    每次 checkout 都會呼叫，只回傳 (code, lineno)，需要顯示時才由 _format_site 轉成字串。
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        if _is_project_frame(frame.f_code.co_filename):
+            return frame.f_code, frame.f_lineno
+        frame = frame.f_back
+
+    # async engine 在 greenlet 中借出連線，thread stack 看不到呼叫端；改看目前 task 的 coroutine stack
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        for frame in reversed(task.get_stack()):
+            if _is_project_frame(frame.f_code.co_filename):
+                return frame.f_code, frame.f_lineno
+    return None
+
+
+def _format_site(site: tuple | None) -> str:
+    if site is None:
+        return "unknown"
+    code, lineno = site
+    return f"{os.path.relpath(code.co_filename, _PROJECT_ROOT)}:{lineno} ({code.co_name})"
+
+
+class PoolMonitor:
+    """
+    監看一個 engine 的連線池。
+    - checkout / checkin 事件記錄每條連線被借出多久（histogram、最大值）
+    - 每次 checkout 記下借出位置（只存 code 物件與行號，顯示時才格式化）
+    - 歸還時超過 leak_threshold 秒就記 warning，附上借出它的程式位置
+    - snapshot() 另外列出目前仍借出且已超過門檻的連線（還沒歸還的洩漏也看得到）
+    """
+
+    def __init__(self, name: str, engine, leak_threshold: float, max_overflow: int):
+        self.name = name
+        self.engine = engine
+        self.leak_threshold = leak_threshold
+        self.max_overflow = max_overflow      # 建立 engine 時設定的值（pool 沒有公開的 API 可讀）
+        self.checkouts = 0
+        self.long_held = 0
+        self.max_held_ms = 0.0
+        self.counts = [0] * (len(CHECKOUT_BUCKETS_MS) + 1)
+        self._held: dict[int, tuple[float, tuple | None]] = {}  # id(connection_record) → (借出時間, 借出位置)
+
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checkouts += 1
+        self._held[id(connection_record)] = (time.monotonic(), _call_site())
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        item = self._held.pop(id(connection_record), None)
+        if item is None:
+            return
+        started, site = item
+        held = time.monotonic() - started
+        held_ms = held * 1000
+
+        for i, bound in enumerate(CHECKOUT_BUCKETS_MS):
+            if held_ms <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.max_held_ms = max(self.max_held_ms, held_ms)
+
+        if held > self.leak_threshold:
+            self.long_held += 1
+            logger.warning("[%s] connection held %.1fs (threshold %.1fs), checked out at %s",
+                           self.name, held, self.leak_threshold, _format_site(site))
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool
+        now = time.monotonic()
+        held_now = [
+            {"site": _format_site(site), "held_sec": round(now - started, 3)}
+            for started, site in list(self._held.values())
+            if now - started > self.leak_threshold
+        ]
+        buckets = {f"le_{b}ms": c for b, c in zip(CHECKOUT_BUCKETS_MS, self.counts)}
+        buckets["inf"] = self.counts[-1]
+
+        size = pool.size() if hasattr(pool, "size") else None
+        checked_out = pool.checkedout() if hasattr(pool, "checkedout") else len(self._held)
+        capacity = size + max(self.max_overflow, 0) if size else None
+        return {
+            "pool_size": size,
+            "max_overflow": self.max_overflow,
+            "checked_out": checked_out,
+            "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "utilization": round(checked_out / capacity, 4) if capacity else None,  # 借出數 / (pool_size + max_overflow)
+            "checkouts": self.checkouts,
+            "long_held": self.long_held,
+            "max_held_ms": round(self.max_held_ms, 3),
+            "held_buckets": buckets,
+            "leak_threshold_sec": self.leak_threshold,
+            "held_over_threshold": sorted(held_now, key=lambda h: -h["held_sec"]),
+        }
@@ -0,0 +1,136 @@
+"""
+依地圖縮放等級簡化路線（Douglas-Peucker）。
+
+容許誤差 = 該 zoom 下 PIXEL_TOLERANCE 個像素對應的公尺數，zoom 越小（看得越廣）刪掉越多點，
+畫面上看不出差異。輸入 / 輸出都是 encoded polyline（見 polyline.py），結果依 (路線, zoom) 快取。
+
+simplify_many 一次處理多條路線：所有路線的點串成一個陣列，每一輪把所有尚未完成的線段
+一起以 NumPy 計算點到線段距離，距離最大的點超過容許誤差就在該點切成兩段，直到沒有線段需要再切。
+輪數約為遞迴深度（一般路線約 log2(點數)），不會逐點跑 Python 迴圈。
+"""
+from cache import TTLCache
+from polyline import encode, decode
+import numpy as np
+import math
+import os
+
+PIXEL_TOLERANCE = float(os.getenv("ROUTE_PIXEL_TOLERANCE", "1.0"))  # 容許誤差（像素）
+DEFAULT_WEB_ROUTE_ZOOM = int(os.getenv("ROUTE_PUSH_ZOOM", "15"))     # dashboard 未指定 zoom 時推送路線的簡化程度
+MIN_ZOOM, MAX_ZOOM = 0, 22
+SIMPLIFY_CACHE_TTL_SEC = 300
+SIMPLIFY_CACHE_MAXSIZE = 4096
+EQUATOR_M_PER_PX = 156543.03392     # Web Mercator zoom 0 時赤道上每像素公尺數
+M_PER_DEG = 111320.0
+
+simplify_cache = TTLCache(maxsize=SIMPLIFY_CACHE_MAXSIZE, ttl=SIMPLIFY_CACHE_TTL_SEC)
+
+
+def clamp_zoom(zoom) -> int | None:
+    """client 傳來的 zoom；None 或無法解析表示不簡化"""
+    try:
+        return min(max(int(zoom), MIN_ZOOM), MAX_ZOOM)
+    except (TypeError, ValueError):
+        return None
+
+
+def tolerance_m(zoom: int, lat: float) -> float:
+    return EQUATOR_M_PER_PX * math.cos(math.radians(lat)) / (2 ** zoom) * PIXEL_TOLERANCE
+
+
+def _project(coords: np.ndarray) -> np.ndarray:
+    """(lat, lng) 度 → 以公尺為單位的平面座標（等距圓柱，路線範圍內誤差可忽略）"""
+    lat = coords[:, 0]
+    return np.column_stack((coords[:, 1] * np.cos(np.radians(lat)) * M_PER_DEG, lat * M_PER_DEG))
+
+
+def _keep_mask(xy: np.ndarray, bounds: list[tuple[int, int]], tolerances: np.ndarray) -> np.ndarray:
+    """
+    xy：所有路線串接後的平面座標；bounds：各路線在 xy 中的 [start, end] (含)；tolerances：各路線的容許誤差。
+    回傳 xy 中要保留的點。
+    """
+    keep = np.zeros(len(xy), dtype=bool)
+    starts = np.array([b[0] for b in bounds], dtype=np.int64)
+    ends = np.array([b[1] for b in bounds], dtype=np.int64)
+    keep[starts] = True
+    keep[ends] = True
+    tol = np.asarray(tolerances, dtype=np.float64)
+
+    while True:
+        # 只剩端點的線段不用再處理
+        inner = ends - starts - 1
+        active = inner > 0
+        starts, ends, tol, inner = starts[active], ends[active], tol[active], inner[active]
+        if not len(starts):
+            return keep
+
+        # 所有線段的中間點攤平成一個陣列，seg 為每個點所屬的線段
+        seg = np.repeat(np.arange(len(starts)), inner)
+        offsets = np.concatenate(([0], np.cumsum(inner)[:-1]))
+        idx = starts[seg] + 1 + (np.arange(len(seg)) - offsets[seg])
+
+        a = xy[starts][seg]
+        ab = xy[ends][seg] - a
+        ap = xy[idx] - a
+        len2 = np.einsum("ij,ij->i", ab, ab)
+        # 點到線段距離（端點重合時退化成點到點距離）
+        t = np.clip(np.einsum("ij,ij->i", ap, ab) / np.where(len2 > 0, len2, 1.0), 0.0, 1.0)
+        dist = np.hypot(ap[:, 0] - t * ab[:, 0], ap[:, 1] - t * ab[:, 1])
+
+        seg_max = np.maximum.reduceat(dist, offsets)
+        # 各線段第一個達到最大距離的點
+        hit = np.flatnonzero(dist == seg_max[seg])
+        _, first = np.unique(seg[hit], return_index=True)
+        split_at = idx[hit[first]]
+
+        split = seg_max > tol
+        keep[split_at[split]] = True
+        mids = split_at[split]
+        starts = np.concatenate((starts[split], mids))
+        ends = np.concatenate((mids, ends[split]))
+        tol = np.concatenate((tol[split], tol[split]))
+
+
+def simplify_many(encoded_routes: list[str], zoom: int) -> list[str]:
+    """一次簡化多條 encoded polyline（未命中快取的部分合併成一個批次計算）"""
+    results: list[str | None] = [simplify_cache.get((e, zoom)) for e in encoded_routes]
+    todo = [i for i, r in enumerate(results) if r is None]
+    if not todo:
+        return results
+
+    coords, bounds, tolerances, routes = [], [], [], []
+    offset = 0
+    for i in todo:
+        points = decode(encoded_routes[i])
+        if len(points) < 3:
+            results[i] = encoded_routes[i]
+            continue
+        routes.append((i, points))
+        coords.extend((p["lat"], p["lng"]) for p in points)
+        bounds.append((offset, offset + len(points) - 1))
+        tolerances.append(tolerance_m(zoom, points[0]["lat"]))
+        offset += len(points)
+
+    if routes:
+        keep = _keep_mask(_project(np.array(coords, dtype=np.float64)), bounds, np.array(tolerances))
+        for (i, points), (start, end) in zip(routes, bounds):
+            mask = keep[start:end + 1]
+            results[i] = encode([p for p, k in zip(points, mask) if k])
+
+    for i in todo:
+        simplify_cache.set((encoded_routes[i], zoom), results[i])
+    return results
+
+
+def simplify(encoded: str, zoom: int) -> str:
+    return simplify_many([encoded], zoom)[0]
+
+
+def simplify_route_fields(message: dict, zoom: int | None, fields=("path", "path1", "path2")) -> dict:
+    """回傳路線欄位已依 zoom 簡化的新 dict（原訊息不修改）；zoom 為 None 時原樣回傳"""
+    if zoom is None:
+        return message
+    names = [f for f in fields if isinstance(message.get(f), str) and message[f]]
+    if not names:
+        return message
+    simplified = simplify_many([message[f] for f in names], zoom)
+    return {**message, **dict(zip(names, simplified)), "zoom": zoom}
@@ -1,21 +1,130 @@
-from fastapi import APIRouter, Depends, Body
+from fastapi import APIRouter, Depends, Body, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
 from sqlalchemy.orm import Session
+from datetime import datetime
 from typing import List
 from typing import Optional, Dict
 
-from database import get_db 
+from database import get_db, pool_stats, SessionLocal
 from models import Order, User, Driver
-from services import get_current_user, admin_viewer_required
+from services import get_current_user, admin_viewer_required, principal_cache, Principal
+from hashing import password_hasher
+from pagination import encode_cursor, decode_cursor, fetch_page, count_total
+from place_index import place_index
+from route_simplify import simplify_cache
 from schemas import OrderListRq, OrderRp, PaginatedOrdersRp, OrderHistoryRp, TestRq, PaginatedUsersRp, UserListRq, UserRp, DriverRp
+from ws_modules.global_ws import server_ws, manager
+from routers.api_v1.endpoints.route import preview_cache, preview_flights
+import io
+import csv
+import json
 
 
 router = APIRouter()
 
+# 列表排序（keyset 分頁依此順序；check_query_plans.py 也用同一組）
+ORDER_PAGE_ORDER = (Order.created_at.desc(), Order.order_id.desc())
+USER_PAGE_ORDER = (User.id.asc(),)
+
+
+def order_filters(payload: OrderListRq) -> list:
+    filters = []
+
+    # 篩選條件
+    if payload.status:
+        filters.append(Order.status.in_(payload.status))
+    if payload.user_id is not None:
+        filters.append(Order.user_id == payload.user_id)
+    if payload.driver_id is not None:
+        filters.append(Order.driver_id == payload.driver_id)
+
+    # 日期篩選，直接用 UTC
+    if payload.start_date:
+        filters.append(Order.created_at >= payload.start_date)
+    if payload.end_date:
+        filters.append(Order.created_at <= payload.end_date)
+
+    if payload.pickup_name:
+        filters.append(Order.pickup_name.contains(payload.pickup_name))
+    if payload.dropoff_name:
+        filters.append(Order.dropoff_name.contains(payload.dropoff_name))
+
+    return filters
+
+
+def user_filters(payload: UserListRq) -> list:
+    filters = []
+
+    if payload.username:
+        filters.append(User.name.contains(payload.username))
+    if payload.email:
+        filters.append(User.email.contains(payload.email))
+    if payload.phone:
+        filters.append(User.phone.contains(payload.phone))
+    if payload.role:
+        filters.append(User.role == payload.role)
+    if payload.start_date:
+        filters.append(User.created_at >= payload.start_date)
+    if payload.end_date:
+        filters.append(User.created_at <= payload.end_date)
+
+    return filters
+
+
+# ----------------------------
+# 訂單匯出
+# ----------------------------
+EXPORT_COLUMNS = (
+    Order.order_id, Order.user_id, Order.driver_id,
+    Order.pickup_lat, Order.pickup_lng, Order.dropoff_lat, Order.dropoff_lng,
+    Order.pickup_name, Order.dropoff_name, Order.passengers, Order.accept_pooling,
+    Order.status, Order.created_at, Order.updated_at,
+)
+EXPORT_FIELDS = [c.key for c in EXPORT_COLUMNS]
+EXPORT_BATCH_SIZE = 1000    # server-side cursor 每次 FETCH 的筆數，也是每個輸出 chunk 的筆數
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _encode_ndjson(rows, header: bool) -> str:
+    return "".join(
+        json.dumps(dict(zip(EXPORT_FIELDS, map(_iso, row))), ensure_ascii=False, separators=(",", ":")) + "\n"
+        for row in rows
+    )
+
+
+def _encode_csv(rows, header: bool) -> str:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if header:
+        writer.writerow(EXPORT_FIELDS)
+    writer.writerows(tuple(map(_iso, row)) for row in rows)
+    return buf.getvalue()
+
+
+def _export_rows(stmt, encode):
+    """
+    在 StreamingResponse 的 threadpool 中執行。
+    session 自己開關：yield 型 dependency 在回應送出前就會結束，不能沿用 get_db。
+    """
+    with SessionLocal() as db:
+        result = db.execute(stmt)
+        header = True
+        for rows in result.partitions():
+            yield encode(rows, header)
+            header = False
+        if header:
+            # 沒有任何資料時 CSV 仍輸出欄位名稱
+            yield encode([], header)
+
 @router.post("/order", response_model=List[OrderHistoryRp], tags=["Admin"])
 def get_order_admin(
     payload: TestRq = Body(...),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     # 確認 admin 身分
     admin_viewer_required(current_user, db)
@@ -65,8 +174,10 @@ def get_order_admin(
 
 | 欄位 | 類型 | 說明 |
 | :--- | :--- | :--- |
-| `page` | `int` | **分頁頁碼**，預設為 `1`。 |
+| `page` | `int` | **分頁頁碼**，預設為 `1`。深頁建議改用 `cursor`。 |
 | `size` | `int` | **每頁筆數**，預設為 `10`。 |
+| `cursor` | `str` | 上一頁回傳的 `next_cursor`；有值時忽略 `page`，依 `(created_at, order_id)` 取下一頁。 |
+| `total_mode` | `str` | `exact` (COUNT)、`estimate` (planner 估計值)、`none`；預設第一頁 `exact`、帶 cursor 時 `none`。 |
 | `status` | `List[int]` | 依據訂單狀態碼進行**多選**篩選 (例如：`[3, 4]` 查詢行程中和已完成的訂單)。 |
 | `user_id` | `int` | 依特定用戶 ID 篩選。 |
 | `driver_id` | `int` | 依特定司機 ID 篩選。 |
@@ -82,64 +193,48 @@ def get_order_admin(
 
 | 欄位 | 類型 | 說明 |
 | :--- | :--- | :--- |
-| `total` | `int` | 符合篩選條件的**總訂單數**。 |
+| `total` | `int` | 符合篩選條件的**總訂單數** (`total_mode=none` 時為 `null`)。 |
 | `page` | `int` | 當前頁碼。 |
 | `size` | `int` | 每頁筆數。 |
-| `data` | `List[OrderRp]` | 包含當前頁所有訂單詳細資訊的清單。 |
+| `data` | `List[OrderRp]` | 包含當前頁所有訂單詳細資訊的清單，依建立時間**倒序**。 |
+| `has_more` | `bool` | 是否還有下一頁。 |
+| `next_cursor` | `str` | 下一頁的 cursor，沒有下一頁時為 `null`。 |
 
 **錯誤處理：**
 - **401 Unauthorized**: JWT 令牌無效或過期。
 - **403 Forbidden**: 用戶身份**非管理員**。
+- **400 Bad Request**: `cursor` 格式錯誤。
 - **422 Unprocessable Entity**: 請求參數格式錯誤 (例如：日期格式不正確)。
 """
 )
 def list_orders(
     payload: OrderListRq = Body(...),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     # 確認 admin 身分
     admin_viewer_required(current_user, db)
 
-    filters = []
+    query = db.query(Order).filter(*order_filters(payload))
+    total = count_total(query, payload.total_mode or ("none" if payload.cursor else "exact"))
 
-    # 篩選條件
-    if payload.status:
-        filters.append(Order.status.in_(payload.status))
-    if payload.user_id is not None:
-        filters.append(Order.user_id == payload.user_id)
-    if payload.driver_id is not None:
-        filters.append(Order.driver_id == payload.driver_id)
-
-    # 日期篩選，直接用 UTC
-    if payload.start_date:
-        filters.append(Order.created_at >= payload.start_date)
-    if payload.end_date:
-        filters.append(Order.created_at <= payload.end_date)
-
-    if payload.pickup_name:
-        filters.append(Order.pickup_name.contains(payload.pickup_name))
-    if payload.dropoff_name:
-        filters.append(Order.dropoff_name.contains(payload.dropoff_name))
-
-    # 分頁
-    skip = (payload.page - 1) * payload.size
-    total = db.query(Order).filter(*filters).count()
-
-    orders = (
-        db.query(Order)
-        .filter(*filters)
-        .order_by(Order.order_id.asc())
-        .offset(skip)
-        .limit(payload.size)
-        .all()
-    )
+    # 分頁：cursor 為 (created_at, order_id)，任何一頁的成本都與第一頁相同
+    if payload.cursor:
+        created_at, order_id = decode_cursor(payload.cursor, datetime, str)
+        query = query.filter(tuple_(Order.created_at, Order.order_id) < tuple_(created_at, order_id))
+    query = query.order_by(*ORDER_PAGE_ORDER)
+    if not payload.cursor and payload.page > 1:
+        # 舊版 page 分頁（OFFSET，越後面越慢），建議改用 next_cursor
+        query = query.offset((payload.page - 1) * payload.size)
+    orders, has_more = fetch_page(query, payload.size)
 
     # 組成 Response
     return PaginatedOrdersRp(
         total=total,
         page=payload.page,
         size=payload.size,
+        has_more=has_more,
+        next_cursor=encode_cursor(orders[-1].created_at, orders[-1].order_id) if has_more else None,
         data=[
             OrderRp(
                 order_id=o.order_id,
@@ -161,6 +256,59 @@ def list_orders(
         ],
     )
 
+#export order table
+@router.post(
+    "/order/export",
+    tags=["Admin"],
+    summary="訂單匯出 (Admin)",
+    description="""
+### 訂單匯出 (Order Export) 📤
+
+使用與 `/admin/order/filter` 相同的篩選條件 (`OrderListRq`)，以串流方式匯出**所有**符合條件的訂單，
+依建立時間倒序。`page` / `size` / `cursor` / `total_mode` 會被忽略。
+
+資料以 server-side cursor 分批讀取並直接寫出，不論匯出筆數多少，伺服器記憶體用量都固定。
+
+**安全性與權限：**
+- 需在 Header 中提供有效的 **JWT Access Token**。
+- **僅限**通過 `admin_required` 驗證的**管理員**身份才能訪問。
+
+**查詢參數 (Query):**
+| 參數 | 說明 |
+| :--- | :--- |
+| `format` | `ndjson`（預設，每行一筆 JSON）或 `csv`（第一行為欄位名稱）。 |
+
+**回應欄位：** `order_id`, `user_id`, `driver_id`, `pickup_lat`, `pickup_lng`, `dropoff_lat`, `dropoff_lng`,
+`pickup_name`, `dropoff_name`, `passengers`, `accept_pooling`, `status`, `created_at`, `updated_at`（時間為 UTC ISO 8601）。
+
+**錯誤處理：**
+- **401 Unauthorized**: JWT 令牌無效或過期。
+- **403 Forbidden**: 用戶身份**非管理員**。
+"""
+)
+def export_orders(
+    payload: OrderListRq = Body(...),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: Principal = Depends(get_current_user)
+):
+    admin_viewer_required(current_user)
+
+    stmt = (
+        select(*EXPORT_COLUMNS)
+        .where(*order_filters(payload))
+        .order_by(*ORDER_PAGE_ORDER)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    if format == "csv":
+        return StreamingResponse(
+            _export_rows(stmt, _encode_csv), media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="orders.csv"'},
+        )
+    return StreamingResponse(
+        _export_rows(stmt, _encode_ndjson), media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="orders.ndjson"'},
+    )
+
 #get user table
 @router.post(
     "/user/filter", 
@@ -184,8 +332,10 @@ def list_orders(
 
 | 欄位 | 類型 | 篩選方式 | 說明 |
 | :--- | :--- | :--- | :--- |
-| `page` | `int` | 分頁 | **分頁頁碼**，預設為 `1`。 |
+| `page` | `int` | 分頁 | **分頁頁碼**，預設為 `1`。深頁建議改用 `cursor`。 |
 | `size` | `int` | 分頁 | **每頁筆數**，預設為 `10`。 |
+| `cursor` | `str` | 分頁 | 上一頁回傳的 `next_cursor`；有值時忽略 `page`，依 `id` 取下一頁。 |
+| `total_mode` | `str` | 分頁 | `exact` (COUNT)、`estimate` (planner 估計值)、`none`；預設第一頁 `exact`、帶 cursor 時 `none`。 |
 | `username` | `str` | 模糊搜索 | 依用戶名稱 (`name`) 進行搜索 (`contains`)。 |
 | `email` | `str` | 模糊搜索 | 依 Email 進行搜索 (`contains`)。 |
 | `phone` | `str` | 模糊搜索 | 依手機號碼進行搜索 (`contains`)。 |
@@ -200,55 +350,46 @@ def list_orders(
 
 | 欄位 | 類型 | 說明 |
 | :--- | :--- | :--- |
-| `total` | `int` | 符合篩選條件的**總用戶數**。 |
+| `total` | `int` | 符合篩選條件的**總用戶數** (`total_mode=none` 時為 `null`)。 |
 | `page` | `int` | 當前頁碼。 |
 | `size` | `int` | 每頁筆數。 |
 | `data` | `List[UserRp]` | 包含當前頁所有用戶詳細資訊的清單。 |
+| `has_more` | `bool` | 是否還有下一頁。 |
+| `next_cursor` | `str` | 下一頁的 cursor，沒有下一頁時為 `null`。 |
 
 **錯誤處理：**
 - **401 Unauthorized**: JWT 令牌無效或過期。
 - **403 Forbidden**: 用戶身份**非管理員**。
+- **400 Bad Request**: `cursor` 格式錯誤。
 """
 )
 def list_users(
     payload: UserListRq = Body(...),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     # 只有 admin 可以查詢
     admin_viewer_required(current_user, db)
 
-    filters = []
-
-    if payload.username:
-        filters.append(User.name.contains(payload.username))
-    if payload.email:
-        filters.append(User.email.contains(payload.email))
-    if payload.phone:
-        filters.append(User.phone.contains(payload.phone))
-    if payload.role:
-        filters.append(User.role == payload.role)
-    if payload.start_date:
-        filters.append(User.created_at >= payload.start_date)
-    if payload.end_date:
-        filters.append(User.created_at <= payload.end_date)
+    query = db.query(User).filter(*user_filters(payload))
+    total = count_total(query, payload.total_mode or ("none" if payload.cursor else "exact"))
 
-    skip = (payload.page - 1) * payload.size
-    total = db.query(User).filter(*filters).count()
-
-    users = (
-        db.query(User)
-        .filter(*filters)
-        .order_by(User.id.asc())
-        .offset(skip)
-        .limit(payload.size)
-        .all()
-    )
+    # 分頁：cursor 為 id
+    if payload.cursor:
+        (last_id,) = decode_cursor(payload.cursor, int)
+        query = query.filter(User.id > last_id)
+    query = query.order_by(*USER_PAGE_ORDER)
+    if not payload.cursor and payload.page > 1:
+        # 舊版 page 分頁（OFFSET，越後面越慢），建議改用 next_cursor
+        query = query.offset((payload.page - 1) * payload.size)
+    users, has_more = fetch_page(query, payload.size)
 
     return PaginatedUsersRp(
         total=total,
         page=payload.page,
         size=payload.size,
+        has_more=has_more,
+        next_cursor=encode_cursor(users[-1].id) if has_more else None,
         data=[
             UserRp(
                 id=u.id,
@@ -300,7 +441,7 @@ def list_drivers_post(
     # 這裡使用 Optional[Dict] 確保即使不傳 Body 也能正常工作
     payload: Optional[Dict] = Body(default=None), 
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     回傳所有 Driver 資料（小型資料集，不需要分頁或篩選）
@@ -309,8 +450,13 @@ def list_drivers_post(
     # 驗證 admin 權限 (與 GET 版本完全相同)
     admin_viewer_required(current_user, db)
 
-    # 取得所有司機，依照 id 升序 (與 GET 版本完全相同)
-    drivers = db.query(Driver).order_by(Driver.id.asc()).all()
+    # 取得所有司機，依照 id 升序；由記憶體中的車隊狀態表提供（含即時位置），不需查 DB。
+    # 狀態表由 driver endpoints 即時更新、fleet_reload 同步其他 worker，並定期重新載入
+    registry = manager.fleet_registry
+    if registry.loaded:
+        drivers = registry.all()
+    else:
+        drivers = db.query(Driver).order_by(Driver.id.asc()).all()
 
     # 回傳 Pydantic model 列表 (與 GET 版本完全相同)
     return [
@@ -329,3 +475,59 @@ def list_drivers_post(
         for d in drivers
     ]
 
+#get runtime stats
+@router.post(
+    "/stats",
+    response_model=dict,
+    tags=["Admin"],
+    summary="伺服器執行狀態 (Admin)",
+    description="""
+### 伺服器執行狀態 (Runtime Stats) 📈
+
+回傳伺服器內部即時狀態，供監控與容量規劃使用。
+
+**安全性與權限：**
+- 需在 Header 中提供有效的 **JWT Access Token**。
+- **僅限**通過 `admin_viewer_required` 驗證的**管理員 (admin) / 檢視者 (viewer)** 身份才能訪問。
+
+**回應：**
+
+| 欄位 | 說明 |
+| :--- | :--- |
+| `websocket` | 依 client type (`web` / `flutter` / `ros`) 分組：連線數 `connections`、送出佇列總深度 `queue_depth`、最大單一連線深度 `max_queue_depth`、降級丟棄訊息數 `dropped`、因慢速被斷線次數 `evicted`。 |
+| `ros_ingest` | ROS 接收處理階段 (`odom` / `reliable`)：佇列深度、已處理數、丟棄數 (僅 odom)、平均 / 最大延遲（收到 → actor 處理完成）與處理時間 (ms)；`actors` 為每台車 actor 的數量、mailbox 深度、回收數與處理延遲。 |
+| `backplane` | 跨 worker 轉送：類型 (`local` / `postgres`)、本 worker id、已發送 / 已接收 / 丟棄數、等待重組的切片訊息數與逾時丟棄數。注意統計僅代表處理此請求的 worker。 |
+| `ros_rpc` | ROS 請求 / 回覆：等待中的請求數、代其他 worker 送出且尚未回覆的請求數 `relayed`、沒有等待者而略過的回覆數 `dropped_replies`，以及依 message type (`estimate` / `dispatch`) 的往返延遲分佈、超時與取消次數。 |
+| `route_preview_cache` | `/route/preview` 快取：項目數、命中率、LRU 淘汰數，以及進行中 / 合併 (single-flight) 的 ROS 請求數。 |
+| `principal_cache` | 登入身分快取 (token → id / phone / role)：項目數、命中率、淘汰數，以及因使用者修改 / 刪除而失效的次數 `invalidations`。 |
+| `password_hashing` | 密碼 hash process pool：bcrypt cost、worker 數、進行中 / 排隊數、因忙碌回 503 的次數 `rejected`、登入時重新 hash 的次數，以及 `hash` / `verify` 的排隊與執行時間 (ms)。 |
+| `place_index` | 地點自動完成索引：是否已載入、地點數、已快取依次數排序候選清單的常見前綴數 `popular_prefixes`。 |
+| `route_simplify_cache` | 路線簡化結果快取（依路線與 zoom）：項目數、命中率、LRU 淘汰數。 |
+| `trajectory_store` | 車輛軌跡：有 buffer 的車輛數、尚未寫入 / 待重試點數、收到 / 取樣 / 已寫入點數、重試時略過的重複點數、buffer 滿被覆蓋的點數、寫入失敗次數、依保留時間刪除的筆數。 |
+| `replay` | 進行中的軌跡回放（本 worker）：車輛、速度、是否暫停、目前播放時間、預讀 chunk 數、查詢次數、讀取筆數、已送出 frame 數。 |
+| `route_writer` | dispatched / queued routes 批次寫入：待寫入筆數、已寫入筆數、批次數、失敗的寫入次數（含失敗後拆半重寫）、單獨重試多次仍失敗而放棄的筆數。 |
+| `db_pool` | DB 連線池 (`sync` / `async`)：pool 大小、借出 / 閒置 / overflow 連線數、使用率 `utilization`、借出時間分佈、超過 `leak_threshold_sec` 的次數，以及目前仍借出且超過門檻的連線與其借出位置。 |
+"""
+)
+def get_stats(
+    payload: Optional[Dict] = Body(default=None),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    admin_viewer_required(current_user, db)
+
+    return {
+        "websocket": server_ws.queue_stats(),
+        "ros_ingest": server_ws.ingest_stats_snapshot(),
+        "backplane": server_ws.backplane.snapshot(),
+        "ros_rpc": manager.rpc.snapshot(),
+        "route_preview_cache": {**preview_cache.snapshot(), **preview_flights.snapshot()},
+        "principal_cache": principal_cache.snapshot(),
+        "password_hashing": password_hasher.snapshot(),
+        "place_index": place_index.snapshot(),
+        "route_writer": manager.route_writer.snapshot(),
+        "trajectory_store": manager.trajectory_store.snapshot(),
+        "replay": [session.snapshot() for session in server_ws.replays],
+        "route_simplify_cache": simplify_cache.snapshot(),
+        "db_pool": pool_stats(),
+    }
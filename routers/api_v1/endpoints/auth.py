@@ -1,16 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Body
-from sqlalchemy.orm import Session
-from passlib.hash import bcrypt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from hashing import password_hasher
 from datetime import datetime, timedelta
 from typing import Annotated
 from jose import JWTError, jwt
 from fastapi.security import OAuth2PasswordBearer
 import re
 from sqlalchemy.exc import IntegrityError
-from database import get_db
+from database import get_async_db
 from models import User
 from schemas import RegisterRq, RegisterRp, LoginRq, LoginRp, AdminCreateUserRq, AdminCreateUserRp
-from services import create_access_token, get_current_user, admin_viewer_required
+from services import create_access_token, get_current_user_async, admin_viewer_required, Principal
 from sqlalchemy.exc import IntegrityError
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 1 week
@@ -57,32 +58,33 @@ router = APIRouter()
 """,
     tags=["User"]
 )
-def register(user: RegisterRq, db: Session = Depends(get_db)) -> RegisterRp:
+async def register(user: RegisterRq, db: AsyncSession = Depends(get_async_db)) -> RegisterRp:
     # Phone format validation (Taiwan mobile: 09XXXXXXXX)
     if not re.fullmatch(r"^09\d{8}$", user.phone):
         return RegisterRp(status=False, message="Invalid phone format")
 
     # Check if phone already exists
-    existing_user = db.query(User).filter(User.phone == user.phone).first()
+    existing_user = (await db.execute(select(User).where(User.phone == user.phone))).scalars().first()
     if existing_user:
         return RegisterRp(status=False, message="Phone number already exists")
 
+    # 放在 try 外：忙碌時的 503 不應被包成 Server error
+    hashed_password = await password_hasher.hash(user.password)
     try:
-        hashed_password = bcrypt.hash(user.password)
         new_user = User(
             phone=user.phone,
             password_hash=hashed_password,
             name=user.name
         )
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
         return RegisterRp(status=True, message="Registration successful")
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         return RegisterRp(status=False, message="Phone number already exists. (database error)")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return RegisterRp(status=False, message=f"Server error: {e}")
 
 # Login
@@ -120,15 +122,29 @@ def register(user: RegisterRq, db: Session = Depends(get_db)) -> RegisterRp:
 - 任何驗證失敗都會返回：
     - `status`: **`False`**
     - `message`: `"Invalid phone or password"` (不區分手機號碼不存在還是密碼錯誤，以提高安全性)。
+- 密碼驗證服務忙碌時回 **503 Service Unavailable**（附 `Retry-After` header），請稍後重試。
 """,
     tags=["User","Admin"]
 )
-def login(request: LoginRq, db: Session = Depends(get_db)):
+async def login(request: LoginRq, db: AsyncSession = Depends(get_async_db)):
     # Check if user exists
-    user = db.query(User).filter(User.phone == request.phone).first()
-    if not user or not bcrypt.verify(request.password, user.password_hash):
+    user = (await db.execute(select(User).where(User.phone == request.phone))).scalars().first()
+    if not user:
         return {"status": False, "message": "Invalid phone or password"}
 
+    ok, new_hash = await password_hasher.verify_and_update(request.password, user.password_hash)
+    if not ok:
+        return {"status": False, "message": "Invalid phone or password"}
+
+    # bcrypt cost 調整過：以新的 cost 重新 hash
+    if new_hash:
+        try:
+            user.password_hash = new_hash
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            print("rehash 密碼失敗:", e)
+
     # Generate token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -183,13 +199,13 @@ def login(request: LoginRq, db: Session = Depends(get_db)):
 """,
     tags=["Admin"]
 )
-def create_admin_viewer(
+async def create_admin_viewer(
     payload: AdminCreateUserRq = Body(...),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async)
 ) -> AdminCreateUserRp:
     # 1. 確認 admin 身分 (此函式會在非 Admin 時拋出 403)
-    admin_viewer_required(current_user, db)
+    admin_viewer_required(current_user)
 
     # 有效的角色清單
     valid_roles = {"admin", "viewer"}
@@ -199,14 +215,14 @@ def create_admin_viewer(
         return AdminCreateUserRp(status=False, message="Invalid role specified. Must be one of: admin, viewer")
 
     # 4. 檢查手機號碼是否已存在
-    existing_user = db.query(User).filter(User.phone == payload.phone).first()
+    existing_user = (await db.execute(select(User).where(User.phone == payload.phone))).scalars().first()
     if existing_user:
         return AdminCreateUserRp(status=False, message="Phone number already exists")
 
+    # 5. Hash 密碼（放在 try 外：忙碌時的 503 不應被包成 Server error）
+    hashed_password = await password_hasher.hash(payload.password)
+
     try:
-        # 5. Hash 密碼
-        hashed_password = bcrypt.hash(payload.password)
-        
         # 建立新的 User 實例 (注意：您的 User 模型中需要有 name 欄位，已假設存在)
         new_user = User(
             phone=payload.phone,
@@ -217,8 +233,8 @@ def create_admin_viewer(
     
         # 6. 儲存到資料庫
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
         
         return AdminCreateUserRp(
             status=True, 
@@ -227,10 +243,10 @@ def create_admin_viewer(
         )
         
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         # 即使前面檢查過，仍處理潛在的資料庫唯一性錯誤
         return AdminCreateUserRp(status=False, message="Phone number already exists (database integrity error)")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return AdminCreateUserRp(status=False, message=f"Server error: {e}")
 
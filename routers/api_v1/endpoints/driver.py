@@ -1,10 +1,14 @@
-from fastapi import APIRouter, Depends, Body
+from fastapi import APIRouter, Depends, Body, Query, HTTPException
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from database import get_db
-from models import Driver
-from services import get_current_user, admin_viewer_required
-from datetime import datetime, timezone
-from schemas import DriverRp, DriverCreateRq
+from models import Driver, TrajectoryPoint
+from services import get_current_user, admin_viewer_required, Principal
+from datetime import datetime, timezone, timedelta
+from typing import Literal
+from schemas import DriverRp, DriverCreateRq, TrajectoryRp
+from polyline import encode, PATH_FORMAT
+from ws_modules.global_ws import manager
 
 router = APIRouter()
 
@@ -12,7 +16,7 @@ router = APIRouter()
 def create_driver(
     payload: DriverCreateRq = Body(...),
     db: Session = Depends(get_db),
-    current_user=Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     # 確認 admin 身分
     admin_viewer_required(current_user, db)
@@ -31,6 +35,10 @@ def create_driver(
     db.commit()
     db.refresh(new_driver)
 
+    # 同步到記憶體中的車隊狀態表（其他 worker 透過 backplane 重新載入）
+    manager.fleet_registry.upsert(new_driver)
+    manager.server_ws.backplane.publish({"op": "fleet_reload"})
+
     return DriverRp(
         id=new_driver.id,
         name=new_driver.name,
@@ -42,3 +50,84 @@ def create_driver(
         created_at=new_driver.created_at,
         updated_at=new_driver.updated_at
     )
+
+
+MAX_TRAJECTORY_WINDOW = timedelta(hours=24)
+MAX_TRAJECTORY_POINTS = 20000
+
+
+@router.get(
+    "/{name}/trajectory",
+    response_model=TrajectoryRp,
+    response_model_exclude_none=True,
+    tags=["Driver"],
+    summary="車輛軌跡",
+    description="""
+### 查詢車輛歷史軌跡 (Admin / Viewer)
+
+回傳指定車輛在時間區間內的 odom 軌跡（約每秒一點，靜止時每 30 秒一點，依時間排序）。
+軌跡每 5 秒批次寫入 DB，最近幾秒的點可能尚未出現；超過保留時間 (`TRAJECTORY_RETENTION_HOURS`，預設 72 小時) 的資料會被刪除。
+
+**查詢參數 (Query):**
+
+| 參數 | 類型 | 必填 | 說明 |
+| :--- | :--- | :--- | :--- |
+| `from` | `datetime` | 是 | 開始時間 (ISO 8601，建議帶時區)。 |
+| `to` | `datetime` | 否 | 結束時間，預設為現在；區間最長 24 小時。 |
+| `format` | `str` | 否 | `columns` (預設)：`lat` / `lng` 各一個陣列；`polyline`：座標以 encoded polyline 字串 `path` 回傳。 |
+
+**回應 (Response):**
+
+| 欄位 | 說明 |
+| :--- | :--- |
+| `t0` / `t` | 第一個點的時間，以及各點相對 `t0` 的毫秒數。 |
+| `lat` / `lng` | `format=columns` 時的座標陣列。 |
+| `path` / `path_format` | `format=polyline` 時的 encoded polyline (precision 5) 與 `"polyline5"`。 |
+| `yaw` | 各點方向，沒有資料時為 `null`。 |
+| `truncated` | 超過 20000 點時為 `true`，只回傳前 20000 點，請縮小區間後再查詢。 |
+
+**錯誤：** 區間不合法或超過 24 小時回 **400**；非 admin / viewer 回 **403**。
+"""
+)
+def get_trajectory(
+    name: str,
+    start: datetime = Query(..., alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    format: Literal["columns", "polyline"] = Query("columns"),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    admin_viewer_required(current_user, db)
+
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    end = end or datetime.now(timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    if end <= start or end - start > MAX_TRAJECTORY_WINDOW:
+        raise HTTPException(status_code=400, detail="Invalid time range (max 24 hours)")
+
+    rows = db.execute(
+        select(TrajectoryPoint.ts, TrajectoryPoint.lat, TrajectoryPoint.lng, TrajectoryPoint.yaw)
+        .where(TrajectoryPoint.vehicle_name == name, TrajectoryPoint.ts >= start, TrajectoryPoint.ts < end)
+        .order_by(TrajectoryPoint.ts)
+        .limit(MAX_TRAJECTORY_POINTS + 1)
+    ).all()
+    truncated = len(rows) > MAX_TRAJECTORY_POINTS
+    rows = rows[:MAX_TRAJECTORY_POINTS]
+
+    rp = TrajectoryRp(vehicle=name, start=start, end=end, count=len(rows), truncated=truncated)
+    if not rows:
+        return rp
+
+    t0 = rows[0].ts
+    rp.t0 = t0
+    rp.t = [round((r.ts - t0).total_seconds() * 1000) for r in rows]
+    rp.yaw = [r.yaw for r in rows]
+    if format == "polyline":
+        rp.path = encode({"lat": r.lat, "lng": r.lng} for r in rows)
+        rp.path_format = PATH_FORMAT
+    else:
+        rp.lat = [r.lat for r in rows]
+        rp.lng = [r.lng for r in rows]
+    return rp
@@ -1,14 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import select, update, tuple_
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 from uuid import uuid4
-from database import get_db
+from database import get_db, get_async_db
 from models import Order, User
-from schemas import OrderCreate, OrderCreateRp, OrderUpdate, OrderHistoryRp
-from services import get_current_user, admin_viewer_required
+from schemas import OrderCreate, OrderCreateRp, OrderUpdate, OrderHistoryRp, OrderDispatchRp, PlaceSuggestionRp
+from services import get_current_user, get_current_user_async, admin_viewer_required, Principal
 from enums import OrderStatus
 from typing import List
 from ws_modules.global_ws import manager
+from place_index import place_index
+from ws_modules.ros_rpc import RpcCancelled, NoRosConnection
+from pagination import encode_cursor, decode_cursor, fetch_page
 import asyncio
 import datetime
 
@@ -42,10 +48,17 @@ router = APIRouter()
 | `pickup_name` | `str` | 否 | 上車地點名稱 |
 | `dropoff_name` | `str` | 否 | 下車地點名稱 |
 
-**回應欄位 (`OrderCreateRp`):**
+**派車模式 (Query: `mode`):**
+| 值 | 說明 |
+| :--- | :--- |
+| `sync` (預設) | 等待 ROS 派車結果 (最多 10 秒) 後直接回傳 ROS 的 `dispatched` / `queued` JSON。 |
+| `async` | 訂單建立後立即回傳 **202 Accepted**，派車結果之後推送到該用戶的 Flutter WebSocket (`dispatched` / `queued` / `dispatch_failed`)，也可透過 `GET /order/{order_id}/dispatch` 查詢。 |
+
+**回應欄位 (`mode=async`，202 Accepted):**
 - **order\_id** (str): 系統生成的訂單 ID。
 - **status** (int): 訂單狀態碼 (初始為 0)。
 - **message** (str): 執行結果描述。
+- **status\_url** (str): 查詢派車結果的路徑。
 
 **訂單狀態碼定義：**
 | 狀態碼 | 意義 | 描述 |
@@ -64,22 +77,25 @@ router = APIRouter()
 )
 async def create_order(
     order_in: OrderCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    request: Request,
+    mode: str = Query("sync", pattern="^(sync|async)$"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
 ):
     try:
-        pending_orders = db.query(Order).filter(
-            Order.user_id == current_user.id,
-            Order.status == OrderStatus.PENDING.value  # status==0
-        ).all()
-        
-        for o in pending_orders:
-            o.status = OrderStatus.CANCELLED.value  # status=5
-        if pending_orders:
-            db.commit()
-            print(f"已將 user {current_user.id} 的 {len(pending_orders)} 個待派車訂單標記為取消")
+        result = await db.execute(
+            update(Order)
+            .where(
+                Order.user_id == current_user.id,
+                Order.status == OrderStatus.PENDING.value  # status==0
+            )
+            .values(status=OrderStatus.CANCELLED.value)  # status=5
+        )
+        if result.rowcount:
+            await db.commit()
+            print(f"已將 user {current_user.id} 的 {result.rowcount} 個待派車訂單標記為取消")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print("取消舊訂單時發生錯誤:", e)
         raise HTTPException(status_code=500, detail="Failed to cancel old pending orders")
     
@@ -100,15 +116,22 @@ async def create_order(
     
     try:
         db.add(order)
-        db.commit()
-        db.refresh(order)
+        await db.commit()
+        await db.refresh(order)
 
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         if "foreign key" in str(e.orig).lower():
             raise HTTPException(status_code=400, detail="User ID or Driver ID not exist.")
         else:
             raise HTTPException(status_code=500, detail="Database error.")
+
+    # 地點自動完成索引（其他 worker 經 backplane 同步）
+    for name, lat, lng in ((order.pickup_name, order.pickup_lat, order.pickup_lng),
+                           (order.dropoff_name, order.dropoff_lat, order.dropoff_lng)):
+        if name:
+            place_index.add(name, lat, lng)
+            manager.server_ws.backplane.publish({"op": "place_add", "name": name, "lat": lat, "lng": lng})
         
     ros_message = {
         "type": "dispatch",
@@ -126,12 +149,27 @@ async def create_order(
         },
     }
 
-    asyncio.create_task(manager.broadcast_to_ros(ros_message))
+    if mode == "async":
+        # 不等待 ROS，結果由 manager 推送給 user 並記錄供查詢
+        manager.spawn(manager.dispatch_order(ros_message, timeout=10))
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={
+            "order_id": order.order_id,
+            "status": order.status,
+            "message": "Order created, dispatch in progress",
+            "status_url": f"/api/v1/order/{order.order_id}/dispatch",
+        })
 
     try:
-        ros_response = await manager.wait_for_ros_response(order_id, timeout=10)
+        # order_id 本身即唯一，直接作為 correlation id
+        ros_response = await manager.rpc.call(
+            ros_message, corr_field="order_id", correlation_id=order.order_id, timeout=10, request=request
+        )
+    except NoRosConnection:
+        return {"status": "failed", "msg": "No ROS connection"}
     except asyncio.TimeoutError:
         return {"status": "failed", "msg": "ROS dispatch timeout"}
+    except RpcCancelled:
+        return None
         
     # 回傳給 client
     return ros_response
@@ -174,7 +212,7 @@ def update_order(
     order_id: str,
     order_in: OrderUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
     # 1. 找訂單
     order = db.query(Order).filter(Order.order_id == order_id).first()
@@ -198,6 +236,43 @@ def update_order(
     # 4. 回傳結果
     return OrderCreateRp(order_id=order.order_id, status=order.status)
 
+#place name autocomplete
+@router.get(
+    "/places/suggest",
+    response_model=List[PlaceSuggestionRp],
+    tags=["Order"],
+    summary="Suggest pickup / dropoff places",
+    description="""
+### 地點名稱自動完成
+
+依輸入的前綴，從歷史訂單的上下車地點中建議名稱與座標。資料在記憶體中，不查詢資料庫。
+
+**查詢參數 (Query):**
+| 參數 | 類型 | 說明 |
+| :--- | :--- | :--- |
+| `q` | `str` | 名稱前綴（不分大小寫）。 |
+| `lat` / `lng` | `float` | 選填，呼叫者目前位置；有傳時距離越近的地點排越前面，並回傳 `distance_m`。 |
+| `limit` | `int` | 最多回傳幾筆，預設 `10`，上限 `50`。 |
+
+**排序：** 歷史出現次數越多、距離越近越前面。
+
+**錯誤處理：**
+- **401 Unauthorized**: JWT 令牌無效或過期。
+- **422 Unprocessable Entity**: 缺少 `q` 或只傳了 `lat` / `lng` 其中之一。
+"""
+)
+async def suggest_places(
+    q: str = Query(..., min_length=1, max_length=100),
+    lat: float | None = Query(None, ge=-90, le=90),
+    lng: float | None = Query(None, ge=-180, le=180),
+    limit: int = Query(10, ge=1, le=50),
+    current_user: Principal = Depends(get_current_user_async)
+):
+    # 在 event loop 上執行，與新訂單寫入索引不會並行
+    if (lat is None) != (lng is None):
+        raise HTTPException(status_code=422, detail="lat and lng must be provided together")
+    return place_index.suggest(q, lat, lng, limit)
+
 #get order history
 @router.get(
     "/history",
@@ -207,7 +282,13 @@ def update_order(
     description="""
 ### 取得用戶訂單歷史 (Order History)
 
-此端點用於已驗證的用戶，**依時間倒序** (`created_at.desc()`) 取得所有已建立的訂單紀錄清單。
+此端點用於已驗證的用戶，**依時間倒序** (`created_at.desc()`) 分頁取得已建立的訂單紀錄清單。
+
+**查詢參數 (Query):**
+| 參數 | 類型 | 說明 |
+| :--- | :--- | :--- |
+| `limit` | `int` | 每頁筆數，預設 `50`，上限 `200`。 |
+| `cursor` | `str` | 上一頁回應 header `X-Next-Cursor` 的值；不傳則從最新的訂單開始。 |
 
 **安全性：**
 需在 Header 中提供有效的 **JWT Access Token**。系統僅返回該 **JWT 所屬用戶**的歷史訂單。
@@ -218,22 +299,30 @@ def update_order(
 **回應 (Response Model):**
 - 成功返回 **`List[OrderHistoryRp]`** 清單模型。
 - 每個清單項目包含訂單的座標、地點名稱、乘客數、是否接受共乘 (`accept_pooling`)，以及訂單建立日期 (`date`)。
+- Header `X-Has-More`: 是否還有更舊的訂單 (`true` / `false`)；`X-Next-Cursor`: 下一頁的 cursor (僅在還有下一頁時提供)。
 
 **錯誤處理：**
+- **400 Bad Request**: `cursor` 格式錯誤。
 - **401 Unauthorized**: JWT 令牌無效或過期。
 - **200 OK**: 如果該用戶沒有任何歷史訂單，則返回一個 **空清單 `[]`**。
 """
 )
 def get_order_history(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = Query(None),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
-    orders = (
-        db.query(Order)
-        .filter(Order.user_id == current_user.id)
-        .order_by(Order.created_at.desc())
-        .all()
-    )
+    query = db.query(Order).filter(Order.user_id == current_user.id)
+    if cursor:
+        created_at, order_id = decode_cursor(cursor, datetime.datetime, str)
+        query = query.filter(tuple_(Order.created_at, Order.order_id) < tuple_(created_at, order_id))
+    orders, has_more = fetch_page(query.order_by(Order.created_at.desc(), Order.order_id.desc()), limit)
+
+    response.headers["X-Has-More"] = "true" if has_more else "false"
+    if has_more:
+        response.headers["X-Next-Cursor"] = encode_cursor(orders[-1].created_at, orders[-1].order_id)
 
     return [
         OrderHistoryRp(
@@ -250,6 +339,61 @@ def get_order_history(
         for o in orders
     ]
 
+#Get dispatch status
+@router.get(
+    "/{order_id}/dispatch",
+    response_model=OrderDispatchRp,
+    tags=["Order"],
+    summary="Get order dispatch status",
+    description="""
+### 查詢派車結果
+
+供 `POST /order?mode=async` 建立的訂單查詢派車結果，例如 WebSocket 斷線重連後補取。
+
+**安全性：**
+需在 Header 中提供有效的 **JWT Access Token**。用戶只能查詢**自己**的訂單。
+`Authorization: Bearer <your_token>`
+
+**回應 (Response Model: OrderDispatchRp):**
+| 欄位 | 類型 | 說明 |
+| :--- | :--- | :--- |
+| `order_id` | `str` | 訂單 ID。 |
+| `state` | `str` | `pending` 派車中、`dispatched` 已派車、`queued` 等車中、`failed` 派車失敗、`cancelled` 已取消、`completed` 已完成。 |
+| `result` | `dict` | ROS 回傳的 `dispatched` / `queued` 內容 (若仍在記憶體中)。 |
+
+**錯誤處理：**
+- **401 Unauthorized**: JWT 令牌無效或過期。
+- **403 Forbidden**: 嘗試查詢**非本人**的訂單。
+- **404 Not Found**: 該 `order_id` 不存在。
+"""
+)
+async def get_dispatch_status(
+    order_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async)
+):
+    # async：dispatch_status 是 event loop 專用的 TTLCache，不能在 threadpool 中讀取
+    order = (await db.execute(select(Order).where(Order.order_id == order_id))).scalars().first()
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if order.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to view this order")
+
+    cached = manager.dispatch_status.get(order_id)
+    if cached:
+        return cached
+
+    # 記憶體中沒有（已過期或重啟），依訂單狀態推算
+    state = {
+        OrderStatus.PENDING.value: "pending",
+        OrderStatus.ACCEPTED.value: "queued",
+        OrderStatus.ASSIGNED.value: "dispatched",
+        OrderStatus.IN_PROGRESS.value: "dispatched",
+        OrderStatus.COMPLETED.value: "completed",
+        OrderStatus.CANCELLED.value: "cancelled",
+    }.get(order.status, "pending")
+    return OrderDispatchRp(order_id=order_id, state=state)
+
 #Get Single Order
 @router.get(
     "/{order_id}", 
@@ -283,7 +427,7 @@ def get_order_history(
 def get_order(
     order_id: str,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     order = db.query(Order).filter(Order.order_id == order_id).first()
     if not order:
@@ -297,7 +441,7 @@ def get_order(
 def delete_order(
     order_id: str,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     # 檢查是否為 admin
     admin_viewer_required(current_user, db)
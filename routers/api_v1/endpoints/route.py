@@ -1,12 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
 from models import User
-from services import get_current_user
+from services import get_current_user_async, Principal
 from ws_modules.global_ws import manager
+from ws_modules.ros_rpc import RpcCancelled, NoRosConnection, cancel_on_disconnect
 from schemas import RoutePreviewRq
+from cache import TTLCache, SingleFlight
+from route_simplify import simplify_route_fields
 import asyncio, uuid
 
 router = APIRouter()
 
+PREVIEW_CACHE_TTL_SEC = 15      # 車輛持續移動，估算結果只短暫有效
+PREVIEW_CACHE_MAXSIZE = 2048
+COORD_QUANTUM = 1e-4            # 座標量化單位（約 11 公尺），拖曳地圖 pin 的微小差異視為同一請求
+
+preview_cache = TTLCache(maxsize=PREVIEW_CACHE_MAXSIZE, ttl=PREVIEW_CACHE_TTL_SEC)
+preview_flights = SingleFlight()
+
+
+def _preview_key(req: RoutePreviewRq) -> tuple:
+    return tuple(
+        round(v / COORD_QUANTUM)
+        for v in (req.pickup_lat, req.pickup_lng, req.dropoff_lat, req.dropoff_lng)
+    )
+
+
+async def _estimate(key: tuple, ros_message: dict) -> dict:
+    response = await manager.rpc.call(ros_message, timeout=10)
+    preview_cache.set(key, response)
+    return response
+
 @router.post(
     "/preview",
     tags=["Route"],
@@ -18,9 +41,10 @@ router = APIRouter()
 
 **流程說明：**
 1. **客戶端 (Client)** 傳入起點、終點座標以及一個唯一的 `message_id`。
-2. **Server** 驗證用戶身份並將請求轉發給 **ROS 系統** 進行路徑規劃。
-3. **Server** 等待 ROS 計算結果。
-4. **ROS 系統** 計算完成後，Server 直接將 ROS 返回的 JSON 資料回傳給客戶端。
+2. **Server** 驗證用戶身份，以量化後的起終點座標 (約 11 公尺) 查詢快取，**15 秒內**相同路線直接回傳快取結果。
+3. 未命中時產生不重複的 correlation id，將請求轉發給**一條 ROS 連線**進行路徑規劃；同時進行中的相同請求共用同一次 ROS 計算。
+4. **Server** 等待 ROS 計算結果；若所有等待中的客戶端都已斷線，Server 會取消等待並通知 ROS (`{"type": "cancel", ...}`)。
+5. **ROS 系統** 計算完成後，Server 將 ROS 返回的 JSON 資料回傳給客戶端（`message_id`、`user_id` 還原為此客戶端的值）。
 
 **安全性：**
 需在 Header 中提供有效的 **JWT Access Token**。
@@ -38,15 +62,23 @@ router = APIRouter()
 | `dropoff_lat` | `float` | 是 | 下車地點緯度。 |
 | `dropoff_lng` | `float` | 是 | 下車地點經度。 |
 
+**查詢參數 (Query):**
+
+| 參數 | 類型 | 必填 | 說明 |
+| :--- | :--- | :--- | :--- |
+| `zoom` | `int` (0–22) | 否 | 地圖縮放等級。指定時 `path` 以 Douglas-Peucker 簡化到該 zoom 下誤差約 1 像素，並回傳 `zoom`；未指定時回傳完整路線。 |
+
 **回應 (Response):**
 - **類型：** 直接返回 ROS 系統計算結果的 **JSON 格式**。
 - **結構：** 結構由 ROS 系統定義，通常包含路線、距離、預計時間等資訊。
+- **路線：** `path` 為 encoded polyline 字串（Google Encoded Polyline，precision 5），並附上 `"path_format": "polyline5"`。
 
 **錯誤處理與特殊狀態碼：**
 
 | HTTP 狀態碼 | 情境 | 說明 |
 | :--- | :--- | :--- |
 | **401 Unauthorized** | JWT 令牌無效或過期。 | |
+| **503 Service Unavailable** | 沒有任何 ROS 連線。 | |
 | **504 Gateway Timeout** | Server 等待 **ROS 系統回傳結果超時** (超過 10 秒)。 | 表示 ROS 系統計算時間過長。 |
 | **500 Internal Server Error** | Server 與 ROS 通訊失敗或處理結果時發生未預期錯誤。 | |
 """
@@ -54,7 +86,8 @@ router = APIRouter()
 async def preview_route(
     req: RoutePreviewRq,
     request: Request,
-    current_user: User = Depends(get_current_user)
+    zoom: int | None = Query(None, ge=0, le=22, description="依地圖 zoom 簡化路線，未指定為完整路線"),
+    current_user: Principal = Depends(get_current_user_async)
 ):
     print("request headers:", request.headers)
     print("current_user:", current_user)
@@ -62,30 +95,36 @@ async def preview_route(
     # Step 1. 使用前端傳入的 message_id
     message_id = req.message_id
 
-    # Step 2. 準備要送給 ROS 的封包
+    # Step 2. 準備要送給 ROS 的封包（message_id 由 rpc 產生不重複的 correlation id）
     ros_message = {
         "type": "estimate",
-        "message_id": message_id,
         "user_id": current_user.id,
         "pick_up": {"lat": req.pickup_lat, "lng": req.pickup_lng},
         "drop_off": {"lat": req.dropoff_lat, "lng": req.dropoff_lng},
     }
 
     try:
-        # Step 3. 傳送給 ROS
-        await manager.broadcast_to_ros(ros_message)
-
-        # Step 4. 等待 ROS 回傳結果
+        # Step 3. 先查快取，未命中再傳送給 ROS（相同請求共用同一次呼叫）並等待回傳結果
+        key = _preview_key(req)
+        response = preview_cache.get(key)
         try:
-            response = await manager.wait_for_ros_response(message_id, timeout=10)
-            print("收到 ros 的訊息:", response)
+            if response is None:
+                response = await cancel_on_disconnect(
+                    preview_flights.do(key, lambda: _estimate(key, ros_message)), request
+                )
+                print("收到 ros 的訊息:", response)
+        except NoRosConnection:
+            raise HTTPException(status_code=503, detail="No ROS connection")
         except asyncio.TimeoutError:
             raise HTTPException(status_code=504, detail="ROS response timeout")
+        except RpcCancelled:
+            # client 已離線，回應不會被收到
+            return None
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error waiting for ROS response: {e}")
 
-        # Step 5. 直接回傳 ROS JSON
-        return response
+        # Step 4. 回傳 ROS JSON（還原為 client 的 message_id / user_id）
+        return {**simplify_route_fields(response, zoom), "message_id": message_id, "user_id": current_user.id}
 
     except HTTPException:
         raise
@@ -1,15 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
-from database import get_db
+from database import get_db, get_async_db
 from models import User
 from schemas import UserProfile, UpdateRq, UpdateRp, PasswordUpdate, PasswordUpdateRp
-from services import get_current_user, admin_viewer_required
-from passlib.hash import bcrypt
+from services import get_current_user, get_current_user_record, get_current_user_record_async, admin_viewer_required, invalidate_principal, Principal
+from ws_modules.global_ws import server_ws
+from hashing import password_hasher
 
 router = APIRouter()
 
+
+def _invalidate_principal(user_id: int):
+    # 本 worker 立即失效，其他 worker 經 backplane 通知
+    invalidate_principal(user_id)
+    server_ws.backplane.publish({"op": "principal_invalidate", "user_id": user_id})
+
 # ----------------------------
 # Get Current User Info
 # ----------------------------
@@ -33,7 +41,7 @@ router = APIRouter()
     ```
     """
 )
-def read_current_user(current_user: User = Depends(get_current_user)):
+def read_current_user(current_user: User = Depends(get_current_user_record)):
     return current_user
 
 # ----------------------------
@@ -60,11 +68,12 @@ def read_current_user(current_user: User = Depends(get_current_user)):
 def update_current_user(
     profile_update: UpdateRq,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user_record)
 ):
     try:
         current_user.name = profile_update.name
         db.commit()
+        _invalidate_principal(current_user.id)
         return {"status": True}
     except Exception as e:
         db.rollback()
@@ -95,23 +104,22 @@ def update_current_user(
     Requires a valid Bearer JWT access token in the `Authorization` header.
     """
 )
-def update_password(
+async def update_password(
     password_update: PasswordUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_record_async)
 ):
     # Verify old password
-    if not bcrypt.verify(password_update.old_password, current_user.password_hash):
+    if not await password_hasher.verify(password_update.old_password, current_user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail={"status": False, "message": "Old password is incorrect"}
         )
 
     # Update with new password
-    current_user.password_hash = bcrypt.hash(password_update.new_password)
-    db.add(current_user)
-    db.commit()
-    db.refresh(current_user)
+    current_user.password_hash = await password_hasher.hash(password_update.new_password)
+    await db.commit()
+    _invalidate_principal(current_user.id)
 
     return {"status": True, "message": "Password updated successfully"}
 
@@ -155,7 +163,7 @@ def update_password(
 def delete_user(
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     # 確認權限
     admin_viewer_required(current_user, db)
@@ -172,6 +180,7 @@ def delete_user(
     try:
         db.delete(user)
         db.commit()
+        _invalidate_principal(user_id)
         return {"status": True, "message": f"User {user_id} deleted successfully"}
     except Exception as e:
         db.rollback()
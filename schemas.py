@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field, ConfigDict
 from enum import Enum
-from typing import Optional, List
+from typing import Optional, List, Literal
 from datetime import datetime
 
 # ---------------------
@@ -112,6 +112,21 @@ class OrderCreateRp(BaseModel):
         from_attributes=True # <-- 新寫法
     )
 
+# ---------------------
+# Order Dispatch Status
+# ---------------------
+class OrderDispatchRp(BaseModel):
+    order_id: str
+    state: str                     # pending / dispatched / queued / failed / cancelled / completed
+    result: Optional[dict] = None  # ROS 回傳的 dispatched / queued 內容
+
+class PlaceSuggestionRp(BaseModel):
+    name: str
+    lat: float
+    lng: float
+    count: int                         # 歷史訂單中出現次數
+    distance_m: float | None = None    # 與呼叫者的距離（有傳 lat / lng 時）
+
 # ---------------------
 # Get Order
 # ---------------------
@@ -172,6 +187,8 @@ class OrderListRq(BaseModel):
     dropoff_name: str | None = None
     passengers: int | None = None
     accept_pooling: bool | None = None
+    cursor: str | None = None   # 上一頁回傳的 next_cursor；有值時忽略 page
+    total_mode: Literal["exact", "estimate", "none"] | None = None  # 預設：第一頁 exact，之後 none
 
 """ class OrderRp(BaseModel):
     order_id: str
@@ -186,10 +203,12 @@ class OrderListRq(BaseModel):
     created_at: datetime """
 
 class PaginatedOrdersRp(BaseModel):
-    total: int
+    total: int | None = None
     page: int
     size: int
     data: List[OrderRp]
+    next_cursor: str | None = None
+    has_more: bool = False
 
 # ---------------------
 # Admin get User
@@ -203,6 +222,8 @@ class UserListRq(BaseModel):
     end_date: Optional[datetime] = None
     page: int = 1
     size: int = 10
+    cursor: str | None = None   # 上一頁回傳的 next_cursor；有值時忽略 page
+    total_mode: Literal["exact", "estimate", "none"] | None = None  # 預設：第一頁 exact，之後 none
 
 class UserRp(BaseModel):
     id: int
@@ -214,10 +235,12 @@ class UserRp(BaseModel):
     updated_at: Optional[datetime]
 
 class PaginatedUsersRp(BaseModel):
-    total: int
+    total: int | None = None
     page: int
     size: int
     data: List[UserRp]
+    next_cursor: str | None = None
+    has_more: bool = False
 
 # ---------------------
 # Admin get Driver
@@ -259,6 +282,20 @@ class DriverRp(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class TrajectoryRp(BaseModel):
+    vehicle: str
+    start: datetime
+    end: datetime
+    count: int
+    truncated: bool                      # 超過點數上限，只回傳前面的部分
+    t0: Optional[datetime] = None        # 第一個點的時間
+    t: List[int] = []                    # 各點相對 t0 的毫秒數
+    yaw: List[Optional[float]] = []
+    lat: Optional[List[float]] = None    # format=columns
+    lng: Optional[List[float]] = None
+    path: Optional[str] = None           # format=polyline
+    path_format: Optional[str] = None
+
 # ---------------------
 # Admin create Driver
 # ---------------------
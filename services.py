@@ -3,15 +3,23 @@ from typing import Any
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
 from jose import JWTError, jwt
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db
+from database import get_db, get_async_db, SessionLocal, AsyncSessionLocal
 from models import User
+from cache import TTLCache
+import time
+import threading
 
 SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+PRINCIPAL_CACHE_TTL_SEC = 30       # 其他 worker 的角色 / 刪除變更最晚多久生效
+PRINCIPAL_CACHE_MAXSIZE = 10000
+
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
@@ -26,33 +34,157 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
     return encoded_jwt
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def _decode_token(token: str) -> tuple[str, float | None]:
+    """回傳 (phone, exp)"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         phone: str | None = payload.get("sub")  # 改成 phone
-        if phone is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    if phone is None:
+        raise _credentials_exception()
+    return phone, payload.get("exp")
+
+
+# ----------------------------
+# Principal cache
+# ----------------------------
+class Principal:
+    """已驗證的使用者身分（不綁定 DB session，可跨 request 快取）"""
+    __slots__ = ("id", "phone", "role", "exp")
+
+    def __init__(self, user: User, exp: float | None):
+        self.id = user.id
+        self.phone = user.phone
+        self.role = user.role
+        self.exp = exp
+
+    def __repr__(self) -> str:
+        return f"Principal(id={self.id}, phone={self.phone}, role={self.role})"
+
+
+class PrincipalCache:
+    """
+    token → Principal。
+    sync endpoint 在 threadpool 中查詢，因此加鎖。
+    invalidate(user_id) 讓該使用者所有 token 的快取失效（以 generation 判斷，不必掃描整個快取）。
+    """
+
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_MAXSIZE, ttl: float = PRINCIPAL_CACHE_TTL_SEC):
+        self.cache = TTLCache(maxsize, ttl)
+        self.invalidations = 0
+        self._generation: dict[int, int] = {}  # user_id → 失效次數
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Principal | None:
+        with self._lock:
+            item = self.cache.get(token)
+            if item is None:
+                return None
+            principal, generation = item
+            expired = principal.exp is not None and principal.exp < time.time()
+            if expired or generation != self._generation.get(principal.id, 0):
+                self.cache.pop(token)
+                return None
+            return principal
+
+    def set(self, token: str, principal: Principal, seen_invalidations: int):
+        with self._lock:
+            # 查 DB 期間有使用者被 invalidate，查到的資料可能已過時，不放入快取
+            if seen_invalidations != self.invalidations:
+                return
+            self.cache.set(token, (principal, self._generation.get(principal.id, 0)))
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._generation[user_id] = self._generation.get(user_id, 0) + 1
+            self.invalidations += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.cache.snapshot(), "invalidations": self.invalidations}
+
+
+principal_cache = PrincipalCache()
+
+
+def invalidate_principal(user_id: int):
+    """使用者資料 / 密碼變更或刪除時呼叫（其他 worker 經 backplane 的 principal_invalidate 通知）"""
+    principal_cache.invalidate(user_id)
 
-    user = db.query(User).filter(User.phone == phone).first()  # 改用 phone 查詢
+
+# ----------------------------
+# Dependencies
+# ----------------------------
+def get_current_user(token: str = Depends(oauth2_scheme)) -> Principal:
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
+    phone, exp = _decode_token(token)
+    seen = principal_cache.invalidations
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.phone == phone).first()  # 改用 phone 查詢
+    if user is None:
+        raise _credentials_exception()
+
+    principal = Principal(user, exp)
+    principal_cache.set(token, principal, seen)
+    return principal
+
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme)) -> Principal:
+    """async endpoint / WebSocket 用，查詢不阻塞 event loop"""
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
+    phone, exp = _decode_token(token)
+    seen = principal_cache.invalidations
+    async with AsyncSessionLocal() as db:
+        user = (await db.execute(select(User).where(User.phone == phone))).scalars().first()
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+
+    principal = Principal(user, exp)
+    principal_cache.set(token, principal, seen)
+    return principal
+
+
+def get_current_user_record(
+    principal: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+) -> User:
+    """需要完整 User 資料或要修改 User 的 endpoint 使用（綁定本 request 的 session）"""
+    user = db.get(User, principal.id)
+    if user is None:
+        raise _credentials_exception()
+    return user
+
+
+async def get_current_user_record_async(
+    principal: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """async 版的 get_current_user_record（綁定本 request 的 AsyncSession）"""
+    user = await db.get(User, principal.id)
+    if user is None:
+        raise _credentials_exception()
     return user
 
 
 def admin_viewer_required(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
-) -> User:
+) -> Principal:
     if current_user.role not in ["admin", "viewer"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -0,0 +1,224 @@
+from database import DATABASE_URL
+import os
+import json
+import uuid
+import time
+import select
+import asyncio
+import threading
+
+# local    : 單一 worker（預設），不做跨 process 轉送
+# postgres : 透過 Postgres LISTEN/NOTIFY 在多個 uvicorn worker 間轉送
+WS_BACKPLANE = os.getenv("WS_BACKPLANE", "local")
+BACKPLANE_CHANNEL = "ws_backplane"
+NOTIFY_MAX_BYTES = 7900      # NOTIFY payload 上限 8000 bytes（以 UTF-8 編碼後的長度計），超過就切片
+CHUNK_TTL_SEC = 30.0         # 切片訊息在這段時間內沒收齊（漏收某片）就丟棄
+PUBLISH_QUEUE_MAXSIZE = 10000
+
+
+class LocalBackplane:
+    """單一 worker 時使用：publish 不做任何事"""
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex[:12]
+
+    async def start(self, handler):
+        pass
+
+    def publish(self, message: dict):
+        pass
+
+    async def stop(self):
+        pass
+
+    def snapshot(self) -> dict:
+        return {"type": "local", "worker_id": self.worker_id}
+
+
+class PostgresBackplane:
+    """
+    以 Postgres LISTEN/NOTIFY 當作 worker 之間的 pub/sub。
+    - publish() 不阻塞：放入佇列，由背景 task 在 thread 中執行 pg_notify
+    - 監聽在獨立 thread 中以 select() 等待 notify，再丟回 event loop 呼叫 handler
+    - 每則訊息帶 worker_id，自己發出的訊息會被忽略
+    - 超過 NOTIFY_MAX_BYTES 的訊息切片傳送，接收端重組；逾時未收齊的切片會被丟棄
+    """
+
+    def __init__(self, dsn: str = DATABASE_URL, channel: str = BACKPLANE_CHANNEL):
+        self.dsn = dsn
+        self.channel = channel
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.chunks_expired = 0
+        self._handler = None
+        self._loop = None
+        self._queue: asyncio.Queue | None = None
+        self._publisher: asyncio.Task | None = None
+        self._listener: threading.Thread | None = None
+        self._stopping = threading.Event()
+        self._pub_conn = None
+        self._chunks: dict[str, tuple[float, list]] = {}   # msg id → (第一片收到的時間, 各片)
+
+    async def start(self, handler):
+        import psycopg2
+
+        self._handler = handler
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=PUBLISH_QUEUE_MAXSIZE)
+
+        self._pub_conn = psycopg2.connect(self.dsn)
+        self._pub_conn.autocommit = True
+
+        self._listener = threading.Thread(target=self._listen, name="ws-backplane-listen", daemon=True)
+        self._listener.start()
+        self._publisher = asyncio.create_task(self._publish_loop())
+        print(f"backplane (postgres) 啟動，worker {self.worker_id}")
+
+    async def stop(self):
+        self._stopping.set()
+        if self._publisher:
+            self._publisher.cancel()
+            await asyncio.gather(self._publisher, return_exceptions=True)
+        if self._pub_conn:
+            self._pub_conn.close()
+
+    # ----------------------
+    # 發送
+    # ----------------------
+    def publish(self, message: dict):
+        if self._queue is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._enqueue(message)
+        else:
+            # sync endpoint 在 threadpool 中呼叫
+            self._loop.call_soon_threadsafe(self._enqueue, message)
+
+    def _enqueue(self, message: dict):
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _publish_loop(self):
+        while True:
+            message = await self._queue.get()
+            payload = json.dumps({"origin": self.worker_id, **message})
+            try:
+                await asyncio.to_thread(self._notify, payload)
+                self.published += 1
+            except Exception as e:
+                print("backplane publish error:", e)
+
+    def _chunk(self, msg_id: str, seq: int, total: int, part: str) -> str:
+        return json.dumps({
+            "origin": self.worker_id, "op": "_chunk",
+            "id": msg_id, "seq": seq, "total": total, "data": part,
+        })
+
+    def _split(self, payload: str, msg_id: str) -> list[str]:
+        """
+        依包裝後的實際大小切片：data 放進 JSON 字串時會再跳脫一次（broadcast frame 本身就是 JSON，
+        引號與反斜線加倍、非 ASCII 字元變成 6 bytes 的跳脫序列），所以不能用原始長度切。
+        """
+        budget = NOTIFY_MAX_BYTES - len(self._chunk(msg_id, 99999, 99999, "").encode())
+        parts, i = [], 0
+        while i < len(payload):
+            n = budget
+            while True:
+                part = payload[i:i + n]
+                size = len(json.dumps(part).encode()) - 2
+                if size <= budget:
+                    break
+                n = min(n - 1, n * budget // size)
+            parts.append(part)
+            i += len(part)
+        return [self._chunk(msg_id, seq, len(parts), part) for seq, part in enumerate(parts)]
+
+    def _notify(self, payload: str):
+        with self._pub_conn.cursor() as cur:
+            if len(payload.encode()) <= NOTIFY_MAX_BYTES:
+                cur.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+                return
+
+            for chunk in self._split(payload, uuid.uuid4().hex[:12]):
+                cur.execute("SELECT pg_notify(%s, %s)", (self.channel, chunk))
+
+    # ----------------------
+    # 接收
+    # ----------------------
+    def _listen(self):
+        import psycopg2
+
+        while not self._stopping.is_set():
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._loop.call_soon_threadsafe(self._on_payload, notify.payload)
+                conn.close()
+            except Exception as e:
+                print("backplane listen error:", e)
+                self._stopping.wait(1.0)
+
+    def _on_payload(self, payload: str):
+        try:
+            message = json.loads(payload)
+        except json.JSONDecodeError:
+            return
+        if message.get("origin") == self.worker_id:
+            return
+
+        if message.get("op") == "_chunk":
+            now = time.monotonic()
+            self._expire_chunks(now)
+            _, parts = self._chunks.setdefault(message["id"], (now, [None] * message["total"]))
+            parts[message["seq"]] = message["data"]
+            if any(p is None for p in parts):
+                return
+            del self._chunks[message["id"]]
+            self._on_payload("".join(parts))
+            return
+
+        self.received += 1
+        try:
+            self._handler(message)
+        except Exception as e:
+            print("backplane handler error:", e)
+
+    def _expire_chunks(self, now: float):
+        for msg_id in [k for k, (first, _) in self._chunks.items() if now - first > CHUNK_TTL_SEC]:
+            del self._chunks[msg_id]
+            self.chunks_expired += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "type": "postgres",
+            "worker_id": self.worker_id,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+            "pending_chunked": len(self._chunks),
+            "chunks_expired": self.chunks_expired,
+            "publish_queue_depth": self._queue.qsize() if self._queue else 0,
+        }
+
+
+def create_backplane():
+    if WS_BACKPLANE == "postgres":
+        return PostgresBackplane()
+    return LocalBackplane()
@@ -0,0 +1,128 @@
+from fastapi import WebSocket
+from route_simplify import DEFAULT_WEB_ROUTE_ZOOM
+import json
+import time
+import asyncio
+
+SEND_QUEUE_MAXSIZE = 256          # 每條連線最多暫存的待送訊息數
+MAX_SEND_LAG_SEC = 5.0            # 佇列滿載 / 訊息排隊超過此秒數即視為慢速 client
+DEGRADABLE_CLIENT_TYPES = {"web"} # 可丟棄舊訊息降級的 client（dashboard 只需要最新狀態）
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+
+def encode_frame(message: dict) -> str:
+    """
+    序列化一次，產生可共用於所有接收端的文字 frame。
+    broadcast 時先 encode 再把同一個 frame 放進每條連線的佇列，避免逐一 json.dumps。
+    """
+    return json.dumps(message)
+
+
+class ClientConnection:
+    """
+    單一 WebSocket 連線的送出端。
+    每條連線有自己的有界佇列與 writer task，佇列內放的是已序列化的 frame，
+    broadcast 只負責放入佇列後立即返回，因此單一卡住的 client 不會拖慢其他 client 或呼叫端（例如 ROS 讀取迴圈）。
+
+    慢速 client 處理：
+    - web：佇列滿時丟掉最舊的訊息（降級），持續滿載超過 max_lag 秒則斷線
+    - 其他：訊息不可丟，佇列滿即斷線
+    - 任何訊息排隊超過 max_lag 秒才輪到送出，也會斷線
+    """
+
+    def __init__(self, websocket: WebSocket, client_type: str, on_evict,
+                 user_id: str | None = None, vehicle: str | None = None, identity: str | None = None,
+                 maxsize: int = SEND_QUEUE_MAXSIZE, max_lag: float = MAX_SEND_LAG_SEC):
+        self.websocket = websocket
+        self.client_type = client_type
+        # 連線 metadata，由 ConnectionRegistry 建立索引
+        self.conn_id: int | None = None
+        self.user_id = user_id      # flutter 綁定的 user_id
+        self.vehicle = vehicle      # flutter 綁定的車輛名稱
+        self.identity = identity    # 驗證通過的身分（token sub）
+        self.ingest = None          # ROS 連線的接收處理 pipeline
+        self.route_zoom = DEFAULT_WEB_ROUTE_ZOOM if client_type == "web" else None  # 推送路線的簡化 zoom，None 為不簡化
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.max_lag = max_lag
+        self.degradable = client_type in DEGRADABLE_CLIENT_TYPES
+        self.dropped = 0
+        self.closed = False
+        self._full_since: float | None = None
+        self._on_evict = on_evict
+        self._writer = asyncio.create_task(self._write_loop())
+
+    # ----------------------
+    # 放入佇列（不阻塞）
+    # ----------------------
+    def enqueue(self, frame: str) -> bool:
+        if self.closed:
+            return False
+
+        now = time.monotonic()
+        if self.queue.full():
+            if not self.degradable:
+                self.evict("send queue full")
+                return False
+
+            if self._full_since is None:
+                self._full_since = now
+            elif now - self._full_since > self.max_lag:
+                self.evict(f"send queue full for {now - self._full_since:.1f}s")
+                return False
+
+            # 降級：丟掉最舊的一則
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+
+        self.queue.put_nowait((now, frame))
+        return True
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    # ----------------------
+    # Writer task
+    # ----------------------
+    async def _write_loop(self):
+        try:
+            while True:
+                enqueued_at, frame = await self.queue.get()
+                lag = time.monotonic() - enqueued_at
+                if lag > self.max_lag:
+                    self.evict(f"send lag {lag:.1f}s")
+                    return
+
+                await self.websocket.send_text(frame)
+
+                if self.queue.empty():
+                    self._full_since = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[{self.client_type}] send error: {e}")
+            self.evict("send error")
+
+    # ----------------------
+    # 關閉
+    # ----------------------
+    def evict(self, reason: str):
+        if self.closed:
+            return
+        print(f"[{self.client_type}] evict slow consumer: {reason}")
+        self.close()
+        self._on_evict(self, reason)
+        asyncio.create_task(self._close_socket(reason))
+
+    async def _close_socket(self, reason: str):
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason=f"Slow consumer: {reason}")
+        except Exception:
+            pass
+
+    def close(self):
+        self.closed = True
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
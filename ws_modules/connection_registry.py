@@ -0,0 +1,77 @@
+from fastapi import WebSocket
+from ws_modules.connection import ClientConnection
+import itertools
+
+
+class ConnectionRegistry:
+    """
+    所有 WebSocket 連線的單一索引。
+    conn_id → ClientConnection（含 client_type / user_id / vehicle / identity），
+    並維護 websocket、client type、user、vehicle 的反向索引，新增 / 移除 / 查詢皆為 O(1)。
+    反向索引用 dict 當作有序 set，移除時不需掃描整個 list。
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.by_id: dict[int, ClientConnection] = {}
+        self.by_socket: dict[WebSocket, ClientConnection] = {}
+        self.by_type: dict[str, dict[int, ClientConnection]] = {}
+        self.by_user: dict[str, ClientConnection] = {}  # user_id → 最新的 flutter 連線
+        self.by_vehicle: dict[str, dict[int, ClientConnection]] = {}
+
+    # ----------------------
+    # 新增 / 移除
+    # ----------------------
+    def add(self, conn: ClientConnection) -> ClientConnection:
+        conn.conn_id = next(self._ids)
+        self.by_id[conn.conn_id] = conn
+        self.by_socket[conn.websocket] = conn
+        self.by_type.setdefault(conn.client_type, {})[conn.conn_id] = conn
+        if conn.user_id is not None:
+            self.by_user[conn.user_id] = conn
+        if conn.vehicle is not None:
+            self.by_vehicle.setdefault(conn.vehicle, {})[conn.conn_id] = conn
+        return conn
+
+    def remove(self, websocket: WebSocket) -> ClientConnection | None:
+        conn = self.by_socket.pop(websocket, None)
+        if conn is None:
+            return None
+
+        self.by_id.pop(conn.conn_id, None)
+        self._discard(self.by_type, conn.client_type, conn.conn_id)
+        if conn.vehicle is not None:
+            self._discard(self.by_vehicle, conn.vehicle, conn.conn_id)
+        # 同一 user 重新連線時，舊連線斷開不可移除新的綁定
+        if conn.user_id is not None and self.by_user.get(conn.user_id) is conn:
+            del self.by_user[conn.user_id]
+        return conn
+
+    @staticmethod
+    def _discard(index: dict, key, conn_id: int):
+        group = index.get(key)
+        if group is None:
+            return
+        group.pop(conn_id, None)
+        if not group:
+            del index[key]
+
+    # ----------------------
+    # 查詢
+    # ----------------------
+    def get(self, websocket: WebSocket) -> ClientConnection | None:
+        return self.by_socket.get(websocket)
+
+    def of_type(self, client_type: str | None = None) -> list[ClientConnection]:
+        if client_type is None:
+            return list(self.by_id.values())
+        return list(self.by_type.get(client_type, {}).values())
+
+    def for_user(self, user_id) -> ClientConnection | None:
+        return self.by_user.get(str(user_id))
+
+    def for_vehicle(self, vehicle: str) -> list[ClientConnection]:
+        return list(self.by_vehicle.get(vehicle, {}).values())
+
+    def __len__(self) -> int:
+        return len(self.by_id)
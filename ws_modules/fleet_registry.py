@@ -0,0 +1,120 @@
+from datetime import datetime, timezone
+from sqlalchemy import select
+from database import AsyncSessionLocal
+from models import Driver
+import time
+import asyncio
+
+RELOAD_INTERVAL_SEC = 60.0     # 定期重新載入（status / is_available / total_rides 會在其他地方被修改）
+MISS_RELOAD_MIN_SEC = 10.0     # 收到未知車輛的 odom 時觸發重新載入的最短間隔
+
+
+class DriverState:
+    """單一車輛的即時狀態（slotted，避免每台車一個 dict）"""
+    __slots__ = (
+        "id", "name", "status", "total_rides", "is_available",
+        "current_lat", "current_lng", "yaw", "created_at", "updated_at",
+    )
+
+    def __init__(self, driver: Driver):
+        self.id = driver.id
+        self.name = driver.name
+        self.status = driver.status
+        self.total_rides = driver.total_rides or 0
+        self.is_available = bool(driver.is_available)
+        self.current_lat = driver.current_lat
+        self.current_lng = driver.current_lng
+        self.yaw = driver.yaw
+        self.created_at = driver.created_at
+        self.updated_at = driver.updated_at
+
+
+class FleetRegistry:
+    """
+    Process 內的車隊狀態表。
+    啟動時從 drivers table 載入，之後每 RELOAD_INTERVAL_SEC 重新載入一次，並由 odom 與 driver endpoints 即時更新；
+    收到未知車輛（其他 worker 新增、或啟動時載入失敗）時也會提早重新載入。
+    提供 name → id 解析與即時位置，不需要再查 DB。
+    """
+
+    def __init__(self):
+        self.by_id: dict[int, DriverState] = {}
+        self.by_name: dict[str, DriverState] = {}
+        self.loaded = False
+        self.misses = 0
+        self._last_miss_reload = 0.0
+
+    # ----------------------
+    # 載入 / 同步
+    # ----------------------
+    async def load(self):
+        async with AsyncSessionLocal() as db:
+            drivers = (await db.execute(select(Driver).order_by(Driver.id.asc()))).scalars().all()
+        previous = self.by_id
+        self.by_id = {}
+        self.by_name = {}
+        for d in drivers:
+            state = self.upsert(d)
+            old = previous.get(state.id)
+            # DB 的位置由 position_writer 批次寫入，可能比記憶體中的舊，保留較新的 pose
+            if old and old.updated_at and (state.updated_at is None or old.updated_at > state.updated_at):
+                state.current_lat, state.current_lng, state.yaw = old.current_lat, old.current_lng, old.yaw
+                state.updated_at = old.updated_at
+        self.loaded = True
+        print(f"fleet registry 載入 {len(self.by_id)} 台車")
+
+    def upsert(self, driver: Driver) -> DriverState:
+        state = DriverState(driver)
+        old = self.by_id.get(state.id)
+        if old and self.by_name.get(old.name) is old:
+            del self.by_name[old.name]
+        self.by_id[state.id] = state
+        # 同名時以 id 最小者為準（與原本 query(...).first() 行為一致）
+        current = self.by_name.get(state.name)
+        if current is None or current.id >= state.id:
+            self.by_name[state.name] = state
+        return state
+
+    # ----------------------
+    # 查詢
+    # ----------------------
+    def id_for(self, name: str) -> int | None:
+        state = self.by_name.get(name)
+        return state.id if state else None
+
+    def get(self, name: str) -> DriverState | None:
+        return self.by_name.get(name)
+
+    def all(self) -> list[DriverState]:
+        # 先複製成 list（單一步驟），sync endpoint 在 threadpool 讀取時不會遇到 dict 同時被修改
+        return sorted(list(self.by_id.values()), key=lambda s: s.id)
+
+    # ----------------------
+    # 即時更新
+    # ----------------------
+    def update_pose(self, name: str, lat: float, lng: float, yaw: float | None) -> DriverState | None:
+        state = self.by_name.get(name)
+        if state is None:
+            self.misses += 1
+            return None
+        state.current_lat = lat
+        state.current_lng = lng
+        state.yaw = yaw
+        state.updated_at = datetime.now(timezone.utc)
+        return state
+
+    def should_reload_on_miss(self) -> bool:
+        """未知車輛觸發的重新載入（節流，避免持續送 odom 的未知車輛一直打 DB）"""
+        now = time.monotonic()
+        if now - self._last_miss_reload < MISS_RELOAD_MIN_SEC:
+            return False
+        self._last_miss_reload = now
+        return True
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(RELOAD_INTERVAL_SEC)
+            try:
+                await self.load()
+            except Exception as e:
+                print("重新載入 fleet registry 失敗:", e)
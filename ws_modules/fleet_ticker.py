@@ -0,0 +1,127 @@
+from fastapi import WebSocket
+from ws_modules.connection import encode_frame
+import math
+import time
+import asyncio
+
+DEFAULT_FLEET_RATE_HZ = 2.0   # web 預設每秒推幾次車隊 frame
+MAX_FLEET_RATE_HZ = 10.0      # 單一訂閱者可設定的上限，同時也是 ticker 的基準頻率
+MIN_FLEET_RATE_HZ = 0.1
+STALE_VEHICLE_SEC = 30.0      # 超過此秒數沒有 odom 的車輛從 frame 中移除
+STALE_CHECK_SEC = 1.0         # 每隔多久檢查一次過時車輛（沒有新 odom 時也要移除並推送）
+
+
+class FleetSubscription:
+    __slots__ = ("rate_hz", "next_due", "last_version")
+
+    def __init__(self, rate_hz: float):
+        self.rate_hz = rate_hz
+        self.next_due = 0.0
+        self.last_version = -1
+
+
+class FleetTicker:
+    """
+    Odom 最新值合併 (conflation) + 固定頻率的車隊推播。
+
+    - update(): 每則 odom 只覆蓋該車 (name) 的最新 pose，不直接推播
+    - run(): 以 MAX_FLEET_RATE_HZ 為基準 tick，對到期的訂閱者送出一個批次 frame
+      {"type": "fleet", "vehicles": [<odom>, ...]}，同一 tick 的 frame 只序列化一次
+    - 訂閱者送出佇列尚未清空時跳過該 tick，因此舊的 pose 不會堆在慢速 client 後面
+    - 每 STALE_CHECK_SEC 移除超過 STALE_VEHICLE_SEC 沒有 odom 的車輛，有移除時推送新的 frame
+    """
+
+    def __init__(self, server_ws):
+        self.server_ws = server_ws
+        self.latest: dict[str, tuple[float, dict]] = {}  # name → (收到時間, odom message)
+        self.subscribers: dict[WebSocket, FleetSubscription] = {}
+        self.version = 0
+        self._frame: str | None = None
+        self._frame_version = -1
+        self._last_stale_check = 0.0
+
+    # ----------------------
+    # Conflation
+    # ----------------------
+    def update(self, name: str, message: dict):
+        if not name:
+            return
+        self.latest[name] = (time.monotonic(), message)
+        self.version += 1
+
+    # ----------------------
+    # 訂閱管理
+    # ----------------------
+    def subscribe(self, websocket: WebSocket, rate_hz: float | None = None):
+        self.subscribers[websocket] = FleetSubscription(self._clamp_rate(rate_hz))
+
+    def set_rate(self, websocket: WebSocket, rate_hz: float):
+        sub = self.subscribers.get(websocket)
+        if sub:
+            sub.rate_hz = self._clamp_rate(rate_hz)
+            sub.next_due = 0.0
+
+    def unsubscribe(self, websocket: WebSocket):
+        self.subscribers.pop(websocket, None)
+
+    @staticmethod
+    def _clamp_rate(rate_hz) -> float:
+        try:
+            rate = float(rate_hz) if rate_hz is not None else DEFAULT_FLEET_RATE_HZ
+        except (TypeError, ValueError):
+            rate = DEFAULT_FLEET_RATE_HZ
+        if not math.isfinite(rate):
+            # NaN 會讓 min / max 比較失效而原樣通過；inf 同樣視為無效值
+            rate = DEFAULT_FLEET_RATE_HZ
+        return min(max(rate, MIN_FLEET_RATE_HZ), MAX_FLEET_RATE_HZ)
+
+    # ----------------------
+    # Ticker
+    # ----------------------
+    def _prune_stale(self, now: float):
+        if now - self._last_stale_check < STALE_CHECK_SEC:
+            return
+        self._last_stale_check = now
+        stale = [n for n, (ts, _) in self.latest.items() if now - ts > STALE_VEHICLE_SEC]
+        for name in stale:
+            del self.latest[name]
+        if stale:
+            self.version += 1
+
+    def _build_frame(self) -> str:
+        if self._frame_version != self.version:
+            self._frame = encode_frame({
+                "type": "fleet",
+                "vehicles": [msg for _, msg in self.latest.values()],
+            })
+            self._frame_version = self.version
+        return self._frame
+
+    def tick(self):
+        now = time.monotonic()
+        self._prune_stale(now)
+        for websocket, sub in list(self.subscribers.items()):
+            conn = self.server_ws.connections.get(websocket)
+            if conn is None:
+                # 連線已關閉
+                del self.subscribers[websocket]
+                continue
+
+            if now < sub.next_due or sub.last_version == self.version:
+                continue
+            sub.next_due = now + 1.0 / sub.rate_hz
+
+            # 上一批還沒送完就跳過，下一個 tick 會拿到更新的 pose
+            if conn.depth() > 0:
+                continue
+
+            if conn.enqueue(self._build_frame()):
+                sub.last_version = self.version
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(1.0 / MAX_FLEET_RATE_HZ)
+            try:
+                self.tick()
+            except Exception as e:
+                print("fleet ticker error:", e)
@@ -0,0 +1,122 @@
+import time
+import asyncio
+
+ODOM_QUEUE_MAXSIZE = 64          # odom 只需要最新值，滿了丟最舊的
+RELIABLE_QUEUE_MAXSIZE = 1024    # dispatched / queued / estimate 等不可丟，滿了才對 ROS 施加背壓
+DROP_OLDEST_TYPES = {"odom"}
+
+
+class StageStats:
+    """單一處理階段的累計統計（跨連線共用，連線斷開後仍保留）"""
+    __slots__ = ("name", "processed", "dropped", "total_latency", "max_latency", "total_service", "max_service")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.processed = 0
+        self.dropped = 0
+        self.total_latency = 0.0   # 進佇列 → 處理完成
+        self.max_latency = 0.0
+        self.total_service = 0.0   # handler 本身執行時間
+        self.max_service = 0.0
+
+    def record(self, latency: float, service: float):
+        self.processed += 1
+        self.total_latency += latency
+        self.total_service += service
+        self.max_latency = max(self.max_latency, latency)
+        self.max_service = max(self.max_service, service)
+
+    def snapshot(self) -> dict:
+        n = self.processed or 1
+        return {
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "avg_latency_ms": round(self.total_latency / n * 1000, 3),
+            "max_latency_ms": round(self.max_latency * 1000, 3),
+            "avg_service_ms": round(self.total_service / n * 1000, 3),
+            "max_service_ms": round(self.max_service * 1000, 3),
+        }
+
+
+class IngestStage:
+    """
+    一條有界佇列 + 一個 worker，依序呼叫 handler(message, received_at, stats)。
+    handler 只負責轉交時（VehicleActorSystem.dispatch），由實際處理完成的地方記錄 stats，
+    延遲才包含後段的處理時間。
+    """
+
+    def __init__(self, handler, stats: StageStats, maxsize: int, drop_oldest: bool):
+        self.handler = handler
+        self.stats = stats
+        self.drop_oldest = drop_oldest
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.closing = False
+        self._busy = False
+        self._worker = asyncio.create_task(self._run())
+
+    async def put(self, message: dict):
+        item = (time.monotonic(), message)
+        if not self.drop_oldest:
+            # 不可丟：佇列滿時等待（背壓傳回 ROS 讀取端）
+            await self.queue.put(item)
+            return
+
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.stats.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(item)
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    async def _run(self):
+        while not (self.closing and self.queue.empty()):
+            enqueued_at, message = await self.queue.get()
+            self._busy = True
+            try:
+                await self.handler(message, enqueued_at, self.stats)
+            except Exception as e:
+                print(f"[ingest:{self.stats.name}] handler error:", e)
+            finally:
+                self._busy = False
+
+    def close(self, drain: bool):
+        """drain=True 時處理完已收到的訊息才結束"""
+        self.closing = True
+        if not drain or (self.queue.empty() and not self._busy):
+            self._worker.cancel()
+
+
+class IngestPipeline:
+    """
+    ROS 連線的接收 / 處理解耦。
+    讀取迴圈只把訊息放入對應的佇列就回去讀下一個 frame，實際處理由 worker task 執行：
+    - odom：drop-oldest，處理不及時只保留較新的
+    - 其他（dispatched / queued / estimate ...）：不丟棄、單一 worker 保持順序
+    handler 通常是 VehicleActorSystem.dispatch，實際處理在各車輛 actor 中並行執行；
+    各階段的延遲為進入佇列 → actor 處理完成。
+    """
+
+    def __init__(self, handler, stats: dict[str, StageStats]):
+        self.stages = {
+            "odom": IngestStage(handler, stats["odom"], ODOM_QUEUE_MAXSIZE, drop_oldest=True),
+            "reliable": IngestStage(handler, stats["reliable"], RELIABLE_QUEUE_MAXSIZE, drop_oldest=False),
+        }
+
+    @staticmethod
+    def new_stats() -> dict[str, StageStats]:
+        return {"odom": StageStats("odom"), "reliable": StageStats("reliable")}
+
+    async def submit(self, message: dict):
+        lane = "odom" if message.get("type") in DROP_OLDEST_TYPES else "reliable"
+        await self.stages[lane].put(message)
+
+    def depths(self) -> dict[str, int]:
+        return {name: stage.depth() for name, stage in self.stages.items()}
+
+    def close(self):
+        self.stages["odom"].close(drain=False)
+        self.stages["reliable"].close(drain=True)
@@ -1,36 +1,74 @@
-from sqlalchemy.orm import Session
-from models import Driver, Order, Route
-from enums import OrderStatus
-from geoalchemy2 import WKTElement
-from database import get_db
+from ws_modules.connection import encode_frame
+from ws_modules.fleet_ticker import FleetTicker
+from ws_modules.position_writer import DriverPositionWriter
+from ws_modules.route_writer import RouteWriter
+from ws_modules.trajectory_store import TrajectoryStore
+from ws_modules.fleet_registry import FleetRegistry
+from ws_modules.ros_rpc import RosRpc, NoRosConnection
+from cache import TTLCache
+from route_simplify import simplify_route_fields
 import asyncio
 
+PING_FRAME = encode_frame({"client_type": "server", "msg": "ping"})
+DISPATCH_STATUS_TTL_SEC = 3600     # 非同步派車結果保留多久供查詢
+DISPATCH_STATUS_MAXSIZE = 10000
+
 class WebSocketManager:
     def __init__(self, server_ws):
         self.server_ws = server_ws
         self._tasks = set() #track background tasks
-        self.pending_responses: dict[str, asyncio.Future] = {}  #wait for response
-        self.vehicle_user_map: dict[str, set[str]] = {}  # vehicle_name → user_id
-
+        self.rpc = RosRpc(server_ws)  # ROS request / reply（estimate / dispatch）
+        self.dispatch_status = TTLCache(DISPATCH_STATUS_MAXSIZE, DISPATCH_STATUS_TTL_SEC)  # order_id → 非同步派車狀態
+        self.fleet_ticker = FleetTicker(server_ws)  # web 車隊位置合併推播
+        self.fleet_registry = FleetRegistry()  # 車隊即時狀態（name → id、admin driver 列表）
+        self.position_writer = DriverPositionWriter(self.fleet_registry.id_for)  # driver 位置批次寫入 DB
+        self.route_writer = RouteWriter()  # dispatched / queued 的 routes 與訂單狀態批次寫入 DB
+        self.trajectory_store = TrajectoryStore()  # 車輛軌跡降頻後批次 COPY 進 DB
 
     async def start_background_tasks(self):
-        task = asyncio.create_task(self.periodic_broadcast())
+        try:
+            await self.fleet_registry.load()
+        except Exception as e:
+            print("載入 fleet registry 失敗:", e)
+
+        try:
+            await self.server_ws.backplane.start(self.server_ws._on_backplane_message)
+        except Exception as e:
+            print("backplane 啟動失敗:", e)
+
+        for coro in (self.periodic_broadcast(), self.fleet_ticker.run(), self.position_writer.run(), self.route_writer.run(),
+                     self.trajectory_store.run(), self.fleet_registry.run()):
+            self.spawn(coro)
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
         self._tasks.add(task)
 
         # 自動移除完成的 task
         task.add_done_callback(lambda t: self._tasks.discard(t))
+        return task
 
     async def stop_background_tasks(self):
+        # 先讓各車輛 actor 處理完已收到的 ROS 訊息，結果才會被下面的 flush 寫入
+        await self.server_ws.vehicle_actors.stop()
+
         for task in list(self._tasks):
             task.cancel()
         # 等待所有 task 完全取消
         await asyncio.gather(*self._tasks, return_exceptions=True)
         self._tasks.clear()
 
+        # 關機前把尚未寫入的 driver 位置 / routes / 軌跡寫回 DB
+        await self.position_writer.flush()
+        await self.route_writer.flush()
+        await self.trajectory_store.flush()
+        await self.server_ws.backplane.stop()
+
     async def periodic_broadcast(self):
         while True:
             await asyncio.sleep(10)  # 每 10 秒推播
-            await self.server_ws.broadcast({"client_type": "server", "msg": "ping"})
+            # 每個 worker 各自 ping 自己的連線，不需要轉送
+            await self.server_ws.broadcast_frame(PING_FRAME, publish=False)
 
     async def broadcast_to_ros(self, ros_message: dict):
         """
@@ -58,145 +96,138 @@ class WebSocketManager:
         else:
             print(f"Failed to send, user {user_id} offline.") """
 
-    async def wait_for_ros_response(self, message_id: str, timeout: int = 10):
+    def set_ros_response(self, message_id: str, data: dict, publish: bool = True):
         """
-        等待 ROS 回覆結果，超時就拋出 asyncio.TimeoutError
+        ROS 收到回覆後呼叫這個方法，把資料交給對應的 RPC 請求
+        等待中的請求不在這個 worker 時，透過 backplane 交給其他 worker
         """
-        fut = asyncio.get_event_loop().create_future()
-        self.pending_responses[message_id] = fut
-        try:
-            return await asyncio.wait_for(fut, timeout)
-        finally:
-            self.pending_responses.pop(message_id, None)
+        self.rpc.resolve(message_id, data, publish=publish)
 
-    def set_ros_response(self, message_id: str, data: dict):
+    # -------------------
+    # 非同步派車
+    # -------------------
+    def set_dispatch_status(self, order_id: str, state: str, result: dict | None = None, publish: bool = True):
+        status = {"order_id": order_id, "state": state, "result": result}
+        self.dispatch_status.set(order_id, status)
+        if publish:
+            self.server_ws.backplane.publish({"op": "dispatch_status", "status": status})
+
+    async def dispatch_order(self, ros_message: dict, timeout: int = 10):
         """
-        ROS 收到回覆後呼叫這個方法，把資料丟給對應的 Future
+        背景送出 dispatch 並等待 ROS 回覆，不佔用 HTTP request。
+        結果 (dispatched / queued) 推送到該 user 的 Flutter 連線，並記錄在 dispatch_status 供查詢。
         """
-        fut = self.pending_responses.get(message_id)
-        if fut and not fut.done():
-            fut.set_result(data)
-            print(f"已設定 ROS 回覆: {message_id}")
+        order_id = ros_message["order_id"]
+        user_id = ros_message["user_id"]
+        self.set_dispatch_status(order_id, "pending")
+
+        try:
+            result = await self.rpc.call(ros_message, corr_field="order_id", correlation_id=order_id, timeout=timeout)
+        except (asyncio.TimeoutError, NoRosConnection) as e:
+            reason = "ROS dispatch timeout" if isinstance(e, asyncio.TimeoutError) else "No ROS connection"
+            await self._dispatch_failed(order_id, user_id, reason)
+            return
+        except Exception as e:
+            # 其他錯誤也要留下 failed 狀態並通知 user，否則查詢會一直停在 pending
+            print(f"dispatch order_id={order_id} 時發生錯誤:", e)
+            await self._dispatch_failed(order_id, user_id, "Dispatch error")
+            return
+
+        self.set_dispatch_status(order_id, result.get("type", "dispatched"), result)
+        await self.server_ws.broadcast_to_user(user_id, result)
+
+    async def _dispatch_failed(self, order_id: str, user_id, reason: str):
+        self.set_dispatch_status(order_id, "failed", {"message": reason})
+        await self.server_ws.broadcast_to_user(user_id, {
+            "type": "dispatch_failed",
+            "order_id": order_id,
+            "message": reason,
+        })
 
     # -------------------
     # Odom 訊息處理
     # -------------------
     async def handle_ros_odom(self, message: dict):
-        name = message.get("name")  # e.g. hero0/ hero1
         pose = message.get("pose", {})
         position = pose.get("position", {})
         yaw = pose.get("yaw")
 
-        await self.server_ws.broadcast(message, client_type="web")
+        self.apply_odom(message)
 
         if position.get("lat") is not None and position.get("lng") is not None:
-            try:
-                # 即時取得 session
-                db_session = next(get_db())
-                driver = db_session.query(Driver).filter(Driver.name == name).first()
-                if driver:
-                    driver.current_lat = position["lat"]
-                    driver.current_lng = position["lng"]
-                    driver.yaw = yaw
-                    db_session.commit()
-            except Exception as e:
-                print("更新 driver 位置時發生錯誤:", e)
+            # 只更新記憶體，由 position_writer 定期依車隊狀態表的 driver id 批次寫入（未知車輛等重新載入後再寫）
+            self.position_writer.update(message.get("name"), position["lat"], position["lng"], yaw)
+            # 軌跡歷史同樣只由收到 odom 的 worker 記錄（依車輛名稱）
+            self.trajectory_store.record(message.get("name"), position["lat"], position["lng"], yaw)
+
+        # 其他 worker 也要更新車隊狀態並推給自己的連線（DB 只由收到 odom 的 worker 寫入）
+        self.server_ws.backplane.publish({"op": "odom", "message": message})
+
+    def apply_odom(self, message: dict):
+        """更新本 worker 的車隊狀態並推播給本 worker 的連線"""
+        name = message.get("name")
+        pose = message.get("pose", {})
+        position = pose.get("position", {})
+
+        # web 只保留每台車最新 pose，由 fleet_ticker 定期批次推播
+        self.fleet_ticker.update(name, message)
 
-        # 發送
-        for user_id in self.vehicle_user_map.get(name, set()):
-            await self.server_ws.broadcast_to_user(user_id, message)
+        state = None
+        if position.get("lat") is not None and position.get("lng") is not None:
+            state = self.fleet_registry.update_pose(name, position["lat"], position["lng"], pose.get("yaw"))
+            if state is None and self.fleet_registry.should_reload_on_miss():
+                # 未知車輛：可能是其他 worker 新增或啟動時載入失敗，重新從 DB 載入
+                self.spawn(self.fleet_registry.load())
+
+        # 發送（只序列化一次，綁定該車的 flutter 連線共用同一個 frame）
+        conns = self.server_ws.connections.for_vehicle(name)
+        if conns:
+            frame = encode_frame(message)
+            for conn in conns:
+                conn.enqueue(frame)
+        return state
 
     # -------------------
     # Dispatch 訊息處理
     # -------------------
+    def push_route(self, message: dict, publish: bool = True):
+        """
+        dispatched / queued 推送給本 worker 的 web 連線。
+        相同 zoom 的連線共用同一個已簡化、已序列化的 frame；其他 worker 收到完整訊息後自行簡化。
+        """
+        by_zoom: dict = {}
+        for conn in self.server_ws.connections.of_type("web"):
+            by_zoom.setdefault(conn.route_zoom, []).append(conn)
+        for zoom, conns in by_zoom.items():
+            frame = encode_frame(simplify_route_fields(message, zoom))
+            for conn in conns:
+                conn.enqueue(frame)
+        if publish:
+            self.server_ws.backplane.publish({"op": "route_push", "message": message})
+
     async def handle_ros_dispatched_queued(self, message: dict):
         """
         處理 ROS dispatched/queued 訊息：
         1. 推送給 Web
         2. 更新訂單狀態
         3. 存 routes table（path1 / path2 都存，存在則更新）
+        2、3 交給 route_writer 在背景批次寫入，handler 不等 DB
         """
         user_id = message.get("user_id")
-        order_id = message.get("order_id")
-        assigned_vehicle = message.get("assigned_vehicle")
-        t = message.get("type")
 
         if not user_id:
             print("收到 dispatched/queued 訊息，但沒有 user_id，無法轉發")
             return
 
-        # --- 1. 推送給 Web ---
-        await self.server_ws.broadcast(message, client_type="web")
-
-        db_session = next(get_db())
-        """ try:
-            # --- 2. 更新訂單狀態 ---
-            order = db_session.query(Order).filter(Order.order_id == order_id).first()
-            if order:
-                if t == "dispatched":
-                    order.status = OrderStatus.ASSIGNED.value
-                elif t == "queued":
-                    order.status = OrderStatus.ACCEPTED.value
-
-                if assigned_vehicle:
-                    driver = db_session.query(Driver).filter(Driver.name == assigned_vehicle).first()
-                    if driver:
-                        order.driver_id = driver.id
-                        print(f"指派 driver {driver.id} 給訂單 {order.order_id}")
-                    else:
-                        print(f"找不到 driver 對應 {assigned_vehicle}")
-                else:
-                    print("沒有 assigned_vehicle，跳過指派 driver")
-            else:
-                print(f"找不到 order_id={order_id} 的訂單")
-
-            # --- 3. 處理 routes ---
-            route_data = {}
-            for path_key in ["path1", "path2"]:
-                path_list = message.get(path_key, [])
-                if path_list:
-                    points_str = ", ".join(f"{pt['lng']} {pt['lat']}" for pt in path_list)
-                    linestring = f"SRID=4326;LINESTRING({points_str})"
-                    route_data[path_key] = linestring
-                else:
-                    route_data[path_key] = None
-
-            # 使用原生 SQL：若 order_id 已存在則更新
-            sql = 
-            INSERT INTO routes (order_id, user_id, vehicle_name, type, eta_to_pick, eta_trip, total_distance_m, path1, path2)
-            VALUES (:order_id, :user_id, :vehicle_name, :type, :eta_to_pick, :eta_trip, :total_distance_m, 
-                    ST_GeomFromEWKT(:path1), ST_GeomFromEWKT(:path2))
-            ON CONFLICT (order_id) DO UPDATE SET
-                user_id = EXCLUDED.user_id,
-                vehicle_name = EXCLUDED.vehicle_name,
-                type = EXCLUDED.type,
-                eta_to_pick = EXCLUDED.eta_to_pick,
-                eta_trip = EXCLUDED.eta_trip,
-                total_distance_m = EXCLUDED.total_distance_m,
-                path1 = EXCLUDED.path1,
-                path2 = EXCLUDED.path2;
-            
-
-            db_session.execute(sql, {
-                "order_id": order_id,
-                "user_id": user_id,
-                "vehicle_name": assigned_vehicle,
-                "type": OrderStatus.ASSIGNED.value if t == "dispatched" else OrderStatus.ACCEPTED.value,
-                "eta_to_pick": message.get("eta_to_pick"),
-                "eta_trip": message.get("eta_trip"),
-                "total_distance_m": message.get("total_distance_m"),
-                "path1": route_data["path1"],
-                "path2": route_data["path2"],
-            })
-
-            db_session.commit()
-            print(f"訂單更新 & route table 已新增/更新 {t} 資料，order_id={order_id}")
+        # --- 1. 推送給 Web（依各 dashboard 的 zoom 簡化路線）---
+        self.push_route(message)
 
+        # --- 2. 更新訂單狀態 / 3. 存 routes：交給背景批次寫入，不在這裡等 DB ---
+        # driver_id 由 route_writer 在 DB 端依 assigned_vehicle 查 drivers，車隊資料尚未載入也不會遺失指派
+        try:
+            self.route_writer.submit(message)
         except Exception as e:
-            db_session.rollback()
-            print("處理 dispatched/queued 時發生錯誤:", e) """
-
-
+            print("處理 dispatched/queued 時發生錯誤:", e)
 
     # -------------------
     # Ready to trip 訊息處理
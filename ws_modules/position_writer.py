@@ -0,0 +1,95 @@
+from sqlalchemy import text
+from database import AsyncSessionLocal
+import math
+import asyncio
+
+FLUSH_INTERVAL_MS = 1000   # 每隔多久批次寫入一次
+DEADBAND_M = 0.5           # 與上次寫入位置距離小於此值（公尺）視為靜止
+DEADBAND_YAW = 2.0         # yaw 變化小於此值視為未轉向
+
+
+def _moved(last: tuple, lat: float, lng: float, yaw: float | None) -> bool:
+    last_lat, last_lng, last_yaw = last
+    # 小範圍以等距圓柱投影估算距離即可
+    dy = (lat - last_lat) * 111320.0
+    dx = (lng - last_lng) * 111320.0 * math.cos(math.radians(lat))
+    if math.hypot(dx, dy) >= DEADBAND_M:
+        return True
+    if (yaw is None) != (last_yaw is None):
+        return True
+    return yaw is not None and abs(yaw - last_yaw) >= DEADBAND_YAW
+
+
+class DriverPositionWriter:
+    """
+    Driver 即時位置的 write-behind 緩衝。
+
+    odom 進來只更新記憶體中每台車（依車輛名稱）最新的 lat/lng/yaw，
+    背景 worker 每 FLUSH_INTERVAL_MS 以 resolve_id（車隊狀態表的 name → id）把有變動的車輛
+    合併成一次依主鍵的 UPDATE ... FROM (VALUES ...)，以 async session 執行，不阻塞 event loop。
+    車隊狀態表中還沒有的車輛（其他 worker 新增、載入失敗）保留最新位置，等狀態表重新載入後再寫入。
+    位置變化在 dead-band 內的車輛不會產生寫入。
+    """
+
+    def __init__(self, resolve_id, flush_interval_ms: int = FLUSH_INTERVAL_MS):
+        self.resolve_id = resolve_id
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.pending: dict[str, tuple[float, float, float | None]] = {}  # vehicle name → 待寫入位置
+        self.written: dict[str, tuple[float, float, float | None]] = {}  # vehicle name → 最後寫入位置
+        self._lock = asyncio.Lock()
+
+    def update(self, name: str, lat: float, lng: float, yaw: float | None):
+        last = self.written.get(name)
+        if last is not None and not _moved(last, lat, lng, yaw):
+            self.pending.pop(name, None)
+            return
+        self.pending[name] = (lat, lng, yaw)
+
+    async def flush(self):
+        async with self._lock:
+            if not self.pending:
+                return
+            batch, held = {}, {}
+            for name, pos in self.pending.items():
+                driver_id = self.resolve_id(name)
+                if driver_id is None:
+                    held[name] = pos
+                else:
+                    batch[name] = (driver_id, pos)
+            self.pending = held
+            if not batch:
+                return
+            try:
+                await self._write(batch)
+            except Exception as e:
+                print("批次更新 driver 位置時發生錯誤:", e)
+                # 寫入失敗就放回去，但不覆蓋期間收到的新位置
+                for name, (_, pos) in batch.items():
+                    self.pending.setdefault(name, pos)
+                return
+            self.written.update((name, pos) for name, (_, pos) in batch.items())
+
+    async def _write(self, batch: dict):
+        values, params = [], {}
+        for i, (driver_id, (lat, lng, yaw)) in enumerate(batch.values()):
+            values.append(
+                f"(CAST(:id{i} AS integer), CAST(:lat{i} AS double precision), "
+                f"CAST(:lng{i} AS double precision), CAST(:yaw{i} AS double precision))"
+            )
+            params.update({f"id{i}": driver_id, f"lat{i}": lat, f"lng{i}": lng, f"yaw{i}": yaw})
+
+        sql = text(f"""
+            UPDATE drivers AS d
+            SET current_lat = v.lat, current_lng = v.lng, yaw = v.yaw, updated_at = now()
+            FROM (VALUES {", ".join(values)}) AS v(id, lat, lng, yaw)
+            WHERE d.id = v.id
+        """)
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(sql, params)
+            await db.commit()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
@@ -0,0 +1,207 @@
+from datetime import datetime, timezone, timedelta
+from collections import deque
+from fastapi import WebSocket
+from sqlalchemy import select
+from database import AsyncSessionLocal
+from models import TrajectoryPoint
+from ws_modules.connection import encode_frame
+from ws_modules.trajectory_store import STATIONARY_HEARTBEAT_SEC
+import time
+import asyncio
+
+FRAME_INTERVAL_SEC = 0.1          # 每隔多久（實際時間）送一個 frame
+MIN_SPEED, MAX_SPEED = 0.1, 600.0
+MAX_REPLAY_WINDOW = timedelta(hours=24)
+CHUNK_SEC = 60.0                  # 每次查詢至少讀多少秒（軌跡時間）的資料
+PREFETCH_WALL_SEC = 2.0           # 每次查詢的資料量至少夠播放這麼多秒（實際時間）
+PREFETCH_CHUNKS = 3               # 預先讀好的 chunk 數，播放跟不上時讀取端暫停
+# 軌跡時間上超過這麼久沒有任何點就直接跳到下一個點（靜止的車仍每 STATIONARY_HEARTBEAT_SEC 有一點，
+# 所以更長的空檔代表車輛離線），與播放速度無關，慢速播放時正常的取樣間隔不會被跳過
+MAX_IDLE_GAP_SEC = 2 * STATIONARY_HEARTBEAT_SEC
+MAX_REPLAY_SESSIONS = 4           # 每個 worker 同時進行的回放數
+
+
+class ReplayError(ValueError):
+    pass
+
+
+def clamp_speed(speed) -> float:
+    try:
+        return min(max(float(speed), MIN_SPEED), MAX_SPEED)
+    except (TypeError, ValueError):
+        raise ReplayError("Invalid speed")
+
+
+def _parse_time(value: str | None, name: str) -> datetime:
+    if not value:
+        raise ReplayError(f"Missing {name}")
+    try:
+        t = datetime.fromisoformat(value)
+    except ValueError:
+        raise ReplayError(f"Invalid {name}")
+    return t if t.tzinfo else t.replace(tzinfo=timezone.utc)
+
+
+class ReplaySession:
+    """
+    以加速的時間軸回放 trajectory_points。
+
+    讀取端依時間順序一段一段查詢（每段 = CHUNK_SEC 或播放 PREFETCH_WALL_SEC 所需的資料量，取大者），
+    放進最多 PREFETCH_CHUNKS 段的佇列；播放端每 FRAME_INTERVAL_SEC 把模擬時間推進 speed 倍，
+    送出期間內各車最新的 pose（格式與即時的 fleet frame 相同，多了 replay / ts 欄位）。
+    回放 1 小時、60 倍速約只需數十次查詢，不會每個 frame 都查 DB。
+    """
+
+    def __init__(self, websocket: WebSocket, start: datetime, end: datetime,
+                 vehicles: list[str] | None, speed: float):
+        if end <= start or end - start > MAX_REPLAY_WINDOW:
+            raise ReplayError("Invalid time range (max 24 hours)")
+        self.websocket = websocket
+        self.start = start
+        self.end = end
+        self.vehicles = vehicles or None     # None = 所有車輛
+        self.speed = clamp_speed(speed)
+        self.paused = False
+        self.sim_time = start.timestamp()
+        self.queries = 0
+        self.rows = 0
+        self.frames = 0
+        self.chunks: asyncio.Queue = asyncio.Queue(maxsize=PREFETCH_CHUNKS)
+
+    @classmethod
+    def from_query(cls, websocket: WebSocket) -> "ReplaySession":
+        """?client_type=web&replay=1&from=<ISO>&to=<ISO>&vehicles=hero1,hero2&speed=60"""
+        params = websocket.query_params
+        start = _parse_time(params.get("from"), "from")
+        end = _parse_time(params.get("to"), "to")
+        vehicles = [v for v in (params.get("vehicles") or "").split(",") if v]
+        return cls(websocket, start, end, vehicles, params.get("speed", 1))
+
+    # ----------------------
+    # client 控制
+    # ----------------------
+    def handle_message(self, message: dict):
+        t = message.get("type")
+        if t == "replay_speed":
+            try:
+                self.speed = clamp_speed(message.get("speed"))
+            except ReplayError:
+                pass
+        elif t == "replay_pause":
+            self.paused = True
+        elif t == "replay_resume":
+            self.paused = False
+
+    # ----------------------
+    # 讀取端
+    # ----------------------
+    async def _fetch(self, t0: datetime, t1: datetime) -> list[tuple]:
+        stmt = (
+            select(TrajectoryPoint.ts, TrajectoryPoint.vehicle_name, TrajectoryPoint.lat,
+                   TrajectoryPoint.lng, TrajectoryPoint.yaw)
+            .where(TrajectoryPoint.ts >= t0, TrajectoryPoint.ts < t1)
+            .order_by(TrajectoryPoint.ts, TrajectoryPoint.vehicle_name)
+        )
+        if self.vehicles:
+            stmt = stmt.where(TrajectoryPoint.vehicle_name.in_(self.vehicles))
+        # 每段查詢各自借用連線，回放期間不長時間佔住 pool
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(stmt)).all()
+        self.queries += 1
+        self.rows += len(rows)
+        return [(r.ts.timestamp(), r.vehicle_name, r.lat, r.lng, r.yaw) for r in rows]
+
+    async def _prefetch(self):
+        t = self.start
+        try:
+            while t < self.end:
+                t1 = min(t + timedelta(seconds=max(CHUNK_SEC, self.speed * PREFETCH_WALL_SEC)), self.end)
+                await self.chunks.put(await self._fetch(t, t1))
+                t = t1
+        except Exception as e:
+            # 查詢失敗（DB 錯誤、pool timeout）也要交給播放端，否則播放端會一直等下一段
+            await self.chunks.put(e)
+            return
+        await self.chunks.put(None)
+
+    # ----------------------
+    # 播放端
+    # ----------------------
+    def _frame(self, latest: dict) -> str:
+        return encode_frame({
+            "type": "fleet",
+            "replay": True,
+            "ts": datetime.fromtimestamp(self.sim_time, timezone.utc).isoformat(),
+            "vehicles": [
+                {"type": "odom", "name": name, "pose": {"position": {"lat": lat, "lng": lng}, "yaw": yaw}}
+                for name, (lat, lng, yaw) in latest.items()
+            ],
+        })
+
+    async def _play(self):
+        pending: deque = deque()
+        exhausted = False
+        last_wall = time.monotonic()
+
+        while True:
+            if not pending and not exhausted:
+                chunk = await self.chunks.get()
+                if isinstance(chunk, Exception):
+                    raise chunk
+                if chunk is None:
+                    exhausted = True
+                else:
+                    pending.extend(chunk)
+                continue
+            if not pending:
+                return
+
+            now = time.monotonic()
+            if not self.paused:
+                self.sim_time += (now - last_wall) * self.speed
+                # 空檔太長（車輛離線 / 沒有資料）直接跳到下一個點
+                if pending[0][0] - self.sim_time > MAX_IDLE_GAP_SEC:
+                    self.sim_time = pending[0][0]
+            last_wall = now
+
+            latest = {}
+            while pending and pending[0][0] <= self.sim_time:
+                _, name, lat, lng, yaw = pending.popleft()
+                latest[name] = (lat, lng, yaw)
+            if latest:
+                await self.websocket.send_text(self._frame(latest))
+                self.frames += 1
+
+            await asyncio.sleep(FRAME_INTERVAL_SEC)
+
+    async def run(self):
+        await self.websocket.send_text(encode_frame({
+            "type": "replay_start",
+            "from": self.start.isoformat(),
+            "to": self.end.isoformat(),
+            "vehicles": self.vehicles,
+            "speed": self.speed,
+        }))
+        prefetch = asyncio.create_task(self._prefetch())
+        try:
+            await self._play()
+        except Exception:
+            await self.websocket.send_text(encode_frame({
+                "type": "replay_end", "queries": self.queries, "rows": self.rows, "error": "Failed to load trajectory",
+            }))
+            raise
+        finally:
+            prefetch.cancel()
+        await self.websocket.send_text(encode_frame({"type": "replay_end", "queries": self.queries, "rows": self.rows}))
+
+    def snapshot(self) -> dict:
+        return {
+            "vehicles": self.vehicles,
+            "speed": self.speed,
+            "paused": self.paused,
+            "position": datetime.fromtimestamp(self.sim_time, timezone.utc).isoformat(),
+            "prefetched_chunks": self.chunks.qsize(),
+            "queries": self.queries,
+            "rows": self.rows,
+            "frames": self.frames,
+        }
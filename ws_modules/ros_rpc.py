@@ -0,0 +1,223 @@
+from fastapi import Request
+from ws_modules.connection import encode_frame
+from ws_modules.backplane import LocalBackplane
+from cache import TTLCache
+import time
+import asyncio
+import itertools
+
+RPC_TIMEOUT_SEC = 10
+RELAY_TTL_SEC = 60           # 代其他 worker 送出的請求，多久內的回覆要轉回去
+RELAY_MAXSIZE = 10000
+DISCONNECT_POLL_SEC = 0.5
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class RpcCancelled(Exception):
+    """HTTP client 已離線，請求已取消"""
+
+
+class NoRosConnection(Exception):
+    """沒有任何可用的 ROS 連線"""
+
+
+async def cancel_on_disconnect(aw, request: Request):
+    """
+    等待 aw 完成；期間 HTTP client 離線就取消 aw 並拋出 RpcCancelled。
+    用於等待的不是 RosRpc.call 本身（例如 single-flight 共用的請求）的情況。
+    """
+    task = asyncio.ensure_future(aw)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SEC)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise RpcCancelled()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+class LatencyHistogram:
+    """單一 message type 的往返延遲分佈"""
+    __slots__ = ("counts", "count", "sum_ms", "max_ms", "timeouts", "cancelled")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.timeouts = 0
+        self.cancelled = 0
+
+    def observe(self, ms: float):
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def snapshot(self) -> dict:
+        buckets = {f"le_{b}ms": c for b, c in zip(LATENCY_BUCKETS_MS, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "buckets": buckets,
+        }
+
+
+class PendingCall:
+    __slots__ = ("future", "type", "corr_field", "started", "conn")
+
+    def __init__(self, future: asyncio.Future, type: str, corr_field: str):
+        self.future = future
+        self.type = type
+        self.corr_field = corr_field
+        self.started = time.monotonic()
+        self.conn = None
+
+
+class RosRpc:
+    """
+    ROS socket 上的 request / reply。
+
+    - correlation id 由 server 產生（worker id + 流水號），不同請求不會互相覆蓋；
+      dispatch 沿用本身唯一的 order_id
+    - 請求只送給一條 ROS 連線（預設挑送出佇列最短的），本 worker 沒有 ROS 連線時經 backplane 轉送；
+      代送的 worker 記下 correlation id，只有這些回覆會經 backplane 轉回（ROS 主動推送的 dispatched / queued 不轉送）
+    - 傳入 Request 時會偵測 HTTP client 離線，取消等待並通知 ROS {"type": "cancel", ...}
+    - 依 message type（estimate / dispatch）記錄往返延遲分佈
+    """
+
+    def __init__(self, server_ws):
+        self.server_ws = server_ws
+        self.pending: dict[str, PendingCall] = {}
+        self.histograms: dict[str, LatencyHistogram] = {}
+        self.relayed = TTLCache(RELAY_MAXSIZE, RELAY_TTL_SEC)   # 代其他 worker 送出的 correlation id
+        self.dropped_replies = 0     # 沒有人在等的回覆（本 worker 沒有等待者，也不是代送的請求）
+        self._seq = itertools.count(1)
+
+    def new_id(self) -> str:
+        return f"{self.server_ws.backplane.worker_id}-{next(self._seq)}"
+
+    def pick_connection(self, conn_id: int | None = None):
+        conns = [c for c in self.server_ws.connections.of_type("ros") if not c.closed]
+        if conn_id is not None:
+            conns = [c for c in conns if c.conn_id == conn_id]
+        return min(conns, key=lambda c: c.depth(), default=None)
+
+    def _histogram(self, type: str) -> LatencyHistogram:
+        hist = self.histograms.get(type)
+        if hist is None:
+            hist = self.histograms[type] = LatencyHistogram()
+        return hist
+
+    # ----------------------
+    # 發送請求
+    # ----------------------
+    async def call(self, message: dict, corr_field: str = "message_id", correlation_id: str | None = None,
+                   timeout: float = RPC_TIMEOUT_SEC, request: Request | None = None, conn_id: int | None = None) -> dict:
+        """
+        送出請求並等待 ROS 回覆。
+        超時拋出 asyncio.TimeoutError，client 離線拋出 RpcCancelled，沒有 ROS 連線拋出 NoRosConnection
+        """
+        cid = correlation_id or self.new_id()
+        if cid in self.pending:
+            raise ValueError(f"Duplicate correlation id: {cid}")
+
+        message = {**message, corr_field: cid}
+        call = PendingCall(asyncio.get_running_loop().create_future(), message.get("type"), corr_field)
+        self.pending[cid] = call
+        watcher = asyncio.create_task(self._watch_disconnect(request, cid)) if request else None
+
+        try:
+            self._send(call, message, conn_id)
+            return await asyncio.wait_for(call.future, timeout)
+        except asyncio.TimeoutError:
+            self._histogram(call.type).timeouts += 1
+            raise
+        except (RpcCancelled, asyncio.CancelledError):
+            self._histogram(call.type).cancelled += 1
+            self._send_cancel(call, cid)
+            raise
+        finally:
+            self.pending.pop(cid, None)
+            if watcher:
+                watcher.cancel()
+
+    def _send(self, call: PendingCall, message: dict, conn_id: int | None = None):
+        frame = encode_frame(message)
+        conn = self.pick_connection(conn_id)
+        if conn:
+            call.conn = conn
+            conn.enqueue(frame)
+        elif not isinstance(self.server_ws.backplane, LocalBackplane):
+            self.server_ws.backplane.publish({
+                "op": "ros_request", "frame": frame, "correlation_id": message.get(call.corr_field),
+            })
+        else:
+            raise NoRosConnection()
+        print("已推送給 ROS:", message)
+
+    def relay(self, frame: str, correlation_id: str | None = None):
+        """其他 worker 經 backplane 轉來的請求：送給本 worker 的一條 ROS 連線，並記下回覆要轉回去"""
+        conn = self.pick_connection()
+        if conn is None:
+            return
+        conn.enqueue(frame)
+        if correlation_id:
+            self.relayed.set(correlation_id, True)
+
+    def _send_cancel(self, call: PendingCall, cid: str):
+        frame = encode_frame({"type": "cancel", "request_type": call.type, call.corr_field: cid})
+        if call.conn and not call.conn.closed:
+            call.conn.enqueue(frame)
+        elif call.conn is None:
+            self.server_ws.backplane.publish({"op": "ros_request", "frame": frame})
+
+    async def _watch_disconnect(self, request: Request, cid: str):
+        while True:
+            await asyncio.sleep(DISCONNECT_POLL_SEC)
+            if await request.is_disconnected():
+                call = self.pending.get(cid)
+                if call and not call.future.done():
+                    call.future.set_exception(RpcCancelled())
+                return
+
+    # ----------------------
+    # 收到回覆
+    # ----------------------
+    def resolve(self, correlation_id: str, data: dict, publish: bool = True) -> bool:
+        call = self.pending.get(correlation_id)
+        if call is None:
+            # 等待者在其他 worker（請求由本 worker 代送）才轉回去，其餘沒有人在等
+            if publish and self.relayed.get(correlation_id):
+                self.relayed.pop(correlation_id)
+                self.server_ws.backplane.publish({"op": "rpc_reply", "message_id": correlation_id, "data": data})
+            elif publish:
+                self.dropped_replies += 1
+            return False
+        if call.future.done():
+            return False
+
+        call.future.set_result(data)
+        self._histogram(call.type).observe((time.monotonic() - call.started) * 1000)
+        print(f"已設定 ROS 回覆: {correlation_id}")
+        return True
+
+    def snapshot(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "relayed": len(self.relayed),
+            "dropped_replies": self.dropped_replies,
+            "types": {t: h.snapshot() for t, h in self.histograms.items()},
+        }
@@ -0,0 +1,166 @@
+from sqlalchemy import text
+from database import AsyncSessionLocal
+from enums import OrderStatus
+from polyline import PRECISION, point_count
+import asyncio
+
+FLUSH_INTERVAL_MS = 200    # 最多累積多久寫一次
+MAX_BATCH = 200            # 累積到這麼多筆就立即寫入
+MAX_ATTEMPTS = 3           # 同一筆單獨寫入失敗幾次後放棄（避免一筆壞資料卡住後面所有批次）
+# 只有還在派車階段的訂單會被 dispatched / queued 更新狀態（避免晚到的訊息覆蓋已取消 / 已完成）
+UPDATABLE_STATUSES = (OrderStatus.PENDING.value, OrderStatus.ACCEPTED.value, OrderStatus.ASSIGNED.value)
+
+
+def line_polyline(encoded) -> str | None:
+    """encoded polyline 原樣寫入，由 PostGIS 解碼；少於兩點無法構成 LINESTRING"""
+    if not isinstance(encoded, str) or point_count(encoded) < 2:
+        return None
+    return encoded
+
+
+class RouteRecord:
+    __slots__ = ("order_id", "user_id", "vehicle_name", "type",
+                 "eta_to_pick", "eta_trip", "total_distance_m", "path1", "path2", "attempts")
+
+    def __init__(self, message: dict):
+        t = message.get("type")
+        self.order_id = message.get("order_id")
+        self.user_id = int(message["user_id"])
+        self.vehicle_name = message.get("assigned_vehicle")
+        self.type = OrderStatus.ASSIGNED.value if t == "dispatched" else OrderStatus.ACCEPTED.value
+        self.eta_to_pick = message.get("eta_to_pick")
+        self.eta_trip = message.get("eta_trip")
+        self.total_distance_m = message.get("total_distance_m")
+        self.path1 = line_polyline(message.get("path1"))
+        self.path2 = line_polyline(message.get("path2"))
+        self.attempts = 0
+
+
+class RouteWriter:
+    """
+    dispatched / queued 的 routes upsert 與訂單狀態更新（write-behind）。
+
+    handler 只把訊息放進 pending（同一 order 只保留最新一筆）就返回，不等 DB；
+    背景 worker 每 FLUSH_INTERVAL_MS 或累積 MAX_BATCH 筆時，把整批組成一個
+    WITH v AS (VALUES ...) UPDATE orders ... INSERT INTO routes ... ON CONFLICT 語句，一次 round trip 寫入。
+    路線以 encoded polyline 傳入，在 DB 端以 ST_LineFromEncodedPolyline 轉成 geometry；
+    訂單的 driver_id 也在 DB 端依 vehicle_name 查 drivers，不依賴記憶體中的車隊資料。
+    整批失敗時對半拆開重寫，只有單獨寫入仍失敗的那一筆會累計 attempts / 被放棄。
+    """
+
+    def __init__(self, flush_interval_ms: int = FLUSH_INTERVAL_MS, max_batch: int = MAX_BATCH):
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_batch = max_batch
+        self.pending: dict[str, RouteRecord] = {}   # order_id → 待寫入
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def submit(self, message: dict):
+        if not message.get("order_id"):
+            return
+        self.pending[message["order_id"]] = RouteRecord(message)
+        if len(self.pending) >= self.max_batch:
+            self._full.set()
+
+    async def flush(self):
+        async with self._lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            failed = await self._write_split(list(batch.values()))
+            # 失敗的放回去下次重試，但不覆蓋期間收到的新資料
+            for record in failed:
+                record.attempts += 1
+                if record.attempts >= MAX_ATTEMPTS:
+                    self.dropped += 1
+                    print(f"放棄寫入 route order_id={record.order_id}")
+                    continue
+                self.pending.setdefault(record.order_id, record)
+
+    async def _write_split(self, records: list[RouteRecord]) -> list[RouteRecord]:
+        """寫入 records，失敗時對半拆開重試；回傳單獨寫入仍失敗的 records"""
+        try:
+            await self._write(records)
+        except Exception as e:
+            self.failures += 1
+            print(f"批次寫入 routes 時發生錯誤（{len(records)} 筆）:", e)
+            if len(records) == 1:
+                return records
+            mid = len(records) // 2
+            return await self._write_split(records[:mid]) + await self._write_split(records[mid:])
+        self.written += len(records)
+        self.batches += 1
+        return []
+
+    async def _write(self, records: list[RouteRecord]):
+        values, params = [], {}
+        for i, r in enumerate(records):
+            values.append(
+                f"(CAST(:order_id{i} AS varchar), CAST(:user_id{i} AS integer), CAST(:vehicle{i} AS varchar), "
+                f"CAST(:type{i} AS smallint), "
+                f"CAST(:eta_to_pick{i} AS double precision), CAST(:eta_trip{i} AS double precision), "
+                f"CAST(:dist{i} AS double precision), CAST(:path1_{i} AS text), CAST(:path2_{i} AS text))"
+            )
+            params.update({
+                f"order_id{i}": r.order_id, f"user_id{i}": r.user_id, f"vehicle{i}": r.vehicle_name,
+                f"type{i}": r.type,
+                f"eta_to_pick{i}": r.eta_to_pick, f"eta_trip{i}": r.eta_trip, f"dist{i}": r.total_distance_m,
+                f"path1_{i}": r.path1, f"path2_{i}": r.path2,
+            })
+
+        sql = text(f"""
+            WITH v(order_id, user_id, vehicle_name, type, eta_to_pick, eta_trip, total_distance_m, path1, path2) AS (
+                VALUES {", ".join(values)}
+            ),
+            d AS (
+                SELECT name, min(id) AS id FROM drivers
+                WHERE name IN (SELECT vehicle_name FROM v)
+                GROUP BY name
+            ),
+            updated AS (
+                UPDATE orders AS o
+                SET status = v.type, driver_id = COALESCE(d.id, o.driver_id), updated_at = now()
+                FROM v LEFT JOIN d ON d.name = v.vehicle_name
+                WHERE o.order_id = v.order_id AND o.status IN ({", ".join(map(str, UPDATABLE_STATUSES))})
+            )
+            INSERT INTO routes (order_id, user_id, vehicle_name, type, eta_to_pick, eta_trip, total_distance_m, path1, path2)
+            SELECT order_id, user_id, vehicle_name, type, eta_to_pick, eta_trip, total_distance_m,
+                   ST_LineFromEncodedPolyline(path1, {PRECISION}), ST_LineFromEncodedPolyline(path2, {PRECISION})
+            FROM v
+            ON CONFLICT (order_id) DO UPDATE SET
+                user_id = EXCLUDED.user_id,
+                vehicle_name = EXCLUDED.vehicle_name,
+                type = EXCLUDED.type,
+                eta_to_pick = EXCLUDED.eta_to_pick,
+                eta_trip = EXCLUDED.eta_trip,
+                total_distance_m = EXCLUDED.total_distance_m,
+                path1 = EXCLUDED.path1,
+                path2 = EXCLUDED.path2,
+                updated_at = now()
+        """)
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(sql, params)
+            await db.commit()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    def snapshot(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "written": self.written,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+        }
@@ -1,44 +1,58 @@
-from fastapi import WebSocket, WebSocketDisconnect, Depends
-from sqlalchemy.orm import Session
-from database import get_db
-from services import get_current_user, admin_viewer_required
+from fastapi import WebSocket, WebSocketDisconnect
+from services import get_current_user_async, admin_viewer_required, invalidate_principal
+from ws_modules.connection import ClientConnection, encode_frame
+from ws_modules.connection_registry import ConnectionRegistry
+from ws_modules.ingest import IngestPipeline
+from ws_modules.vehicle_actors import VehicleActorSystem
+from ws_modules.backplane import create_backplane
+from ws_modules.replay import ReplaySession, ReplayError, MAX_REPLAY_SESSIONS
+from place_index import place_index
+from polyline import encode_route_fields
+from route_simplify import clamp_zoom
 import json
 import asyncio
 
 class WebSocketServer:
     def __init__(self):
-        self.active_connections: dict[str, list[WebSocket]] = {
-            "flutter": [], "ros": [], "web": []
-        }
-        self.user_map: dict[str, WebSocket] = {}  # user_id → websocket
-        self.ros_message_callback = None
+        self.connections = ConnectionRegistry()  # 所有連線與 type / user / vehicle 索引
+        self.evicted: dict[str, int] = {}  # client_type → 被踢掉的慢速連線數
+        self.ingest_stats = IngestPipeline.new_stats()  # ROS 接收處理各階段統計
+        self.vehicle_actors = VehicleActorSystem(self._handle_ros_message)  # 每台車一個 actor
+        self.backplane = create_backplane()  # 多 worker 時轉送 broadcast / user / RPC 回覆
+        self.replays: set[ReplaySession] = set()  # 進行中的軌跡回放（不加入 connections，不收即時推播）
         self.manager = None
 
-    def set_ros_callback(self, callback):
-        self.ros_message_callback = callback
-
     # ----------------------
     # 連線管理
     # ----------------------
-    async def connect(self, websocket: WebSocket, client_type: str):
-        self.active_connections.setdefault(client_type, []).append(websocket)
-        print(f"new WebSocket connection: {client_type}")
+    async def connect(self, websocket: WebSocket, client_type: str,
+                      user_id=None, vehicle: str | None = None, identity: str | None = None) -> ClientConnection:
+        conn = self.connections.add(ClientConnection(
+            websocket, client_type, on_evict=self._on_evict,
+            user_id=str(user_id) if user_id is not None else None,
+            vehicle=vehicle,
+            identity=identity,
+        ))
+        print(f"new WebSocket connection: {client_type} (conn {conn.conn_id})")
+        return conn
+
+    def _on_evict(self, conn: ClientConnection, reason: str):
+        self.evicted[conn.client_type] = self.evicted.get(conn.client_type, 0) + 1
+        self.disconnect(conn.websocket)
 
     def disconnect(self, websocket: WebSocket):
-        for ctype, conns in self.active_connections.items():
-            if websocket in conns:
-                conns.remove(websocket)
-                print(f"WebSocket disconnected: {ctype}")
-        # 移除 user_map 中綁定
-        to_delete = [uid for uid, ws in self.user_map.items() if ws == websocket]
-        for uid in to_delete:
-            del self.user_map[str(uid)]
+        conn = self.connections.remove(websocket)
+        if conn:
+            conn.close()
+            if conn.ingest:
+                conn.ingest.close()
+            print(f"WebSocket disconnected: {conn.client_type} (conn {conn.conn_id})")
 
     # ----------------------
     # 驗證方法
     # ----------------------
     # Web
-    async def verify_web_user(self, websocket, db: Session, timeout: float = 5.0):
+    async def verify_web_user(self, websocket, timeout: float = 5.0):
         try:
             data = await asyncio.wait_for(websocket.receive_text(), timeout=timeout)
         except asyncio.TimeoutError:
@@ -47,8 +61,8 @@ class WebSocketServer:
         
         msg = self._parse_json_or_close(websocket, data, "Auth must be JSON.")
         token = msg.get("token") or await self._close_missing_token(websocket)
-        user = await asyncio.to_thread(lambda: admin_viewer_required(current_user=get_current_user(token, db), db=db))
-        return user
+        user = await get_current_user_async(token)
+        return admin_viewer_required(current_user=user, db=None)
 
     """ # Flutter
     async def verify_flutter_user(self, websocket, db: Session, timeout: float = 5.0):
@@ -77,7 +91,7 @@ class WebSocketServer:
             raise WebSocketDisconnect()
         return user, user_id, vehicle """
     
-    async def verify_flutter_user(self, websocket, db: Session, timeout: float = 5.0):
+    async def verify_flutter_user(self, websocket, timeout: float = 5.0):
         try:
             print("[verify] 等待 Flutter 傳入驗證資料中...")
             data = await asyncio.wait_for(websocket.receive_text(), timeout=timeout)
@@ -106,7 +120,7 @@ class WebSocketServer:
         
         try:
             print(f"[verify] 開始驗證 token 對應的 user（user_id={user_id}）")
-            user = await asyncio.to_thread(lambda: get_current_user(token, db))
+            user = await get_current_user_async(token)
             print(f"[verify] token 驗證成功，用戶 ID: {user.id}")
         except Exception as e:
             print(f"[verify] ❌ get_current_user 失敗: {e}")
@@ -126,11 +140,15 @@ class WebSocketServer:
     # ----------------------
     # 各 client endpoint
     # ----------------------
-    async def websocket_endpoint_web(self, websocket: WebSocket, db: Session = Depends(get_db)):
+    async def websocket_endpoint_web(self, websocket: WebSocket):
         await websocket.accept()
-        user = await self.verify_web_user(websocket, db)
+        user = await self.verify_web_user(websocket)
+        if websocket.query_params.get("replay"):
+            await self.run_replay(websocket, user)
+            return
         print(f"Manager {user.id} connection established.")
-        await self.connect(websocket, "web")
+        await self.connect(websocket, "web", identity=user.phone)
+        self.manager.fleet_ticker.subscribe(websocket, websocket.query_params.get("fleet_rate"))
         
         await self.send_json(websocket, {
             "type": "auth",
@@ -140,19 +158,62 @@ class WebSocketServer:
 
         await self.handle_messages(websocket, "web")
 
-    async def websocket_endpoint_flutter(self, websocket: WebSocket, db: Session = Depends(get_db)):
+    async def run_replay(self, websocket: WebSocket, user):
+        """web 回放模式：串流 trajectory_points 中的歷史軌跡，期間可調整速度 / 暫停"""
+        try:
+            session = ReplaySession.from_query(websocket)
+        except ReplayError as e:
+            await websocket.close(code=4007, reason=str(e))
+            return
+        if len(self.replays) >= MAX_REPLAY_SESSIONS:
+            await websocket.close(code=4009, reason="Too many replay sessions.")
+            return
+        # 檢查後立即佔位（中間不能有 await），避免同時連線都通過上限檢查
+        self.replays.add(session)
+
+        player = reader = None
+        try:
+            print(f"Manager {user.id} replay started.")
+            await self.send_json(websocket, {
+                "type": "auth",
+                "status": "success",
+                "message": f"Manager {user.id} replay established."
+            })
+            player = asyncio.create_task(session.run())
+            reader = asyncio.create_task(self._read_replay_controls(websocket, session))
+            await asyncio.wait({player, reader}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (player, reader):
+                if task:
+                    task.cancel()
+            self.replays.discard(session)
+
+        if player and player.done() and not player.cancelled():
+            if player.exception():
+                print("replay error:", player.exception())
+                await websocket.close(code=1011, reason="Replay failed.")
+            else:
+                # 播放完畢
+                await websocket.close(code=1000, reason="Replay finished.")
+        print(f"Manager {user.id} replay ended.")
+
+    async def _read_replay_controls(self, websocket: WebSocket, session: ReplaySession):
+        while True:
+            try:
+                data = await websocket.receive_text()
+            except WebSocketDisconnect:
+                return
+            message = self._parse_json(data, websocket)
+            if message:
+                session.handle_message(message)
+
+    async def websocket_endpoint_flutter(self, websocket: WebSocket):
         await websocket.accept()
-        user, user_id, vehicle = await self.verify_flutter_user(websocket, db)
+        user, user_id, vehicle = await self.verify_flutter_user(websocket)
         print(f"User {user_id} connection established.")
-        await self.connect(websocket, "flutter")
-
-        # 綁定 user_id → websocket
-        self.user_map[str(user_id)] = websocket
+        # 綁定 user_id / vehicle → 連線
+        await self.connect(websocket, "flutter", user_id=user_id, vehicle=vehicle, identity=user.phone)
 
-        if vehicle not in self.manager.vehicle_user_map:
-            self.manager.vehicle_user_map[vehicle] = set()
-        self.manager.vehicle_user_map[vehicle].add(str(user_id))
-    
         await self.send_json(websocket, {
             "type": "auth",
             "status": "success",
@@ -162,18 +223,14 @@ class WebSocketServer:
         try:
             await self.handle_messages(websocket, "flutter")
         finally:
-            # 當 websocket 關閉時，自動移除該 user
-            if vehicle in self.manager.vehicle_user_map:
-                self.manager.vehicle_user_map[vehicle].discard(str(user_id))
-                if not self.manager.vehicle_user_map[vehicle]:
-                    # 如果該車沒剩任何使用者，刪掉 key
-                    del self.manager.vehicle_user_map[vehicle]
+            # handle_messages 結束時 disconnect 已一併移除 user / vehicle 索引
             print(f"User {user_id} disconnected from vehicle {vehicle}")
 
     async def websocket_endpoint_ros(self, websocket: WebSocket):
         await websocket.accept()
         print("ROS 連線成功")
-        await self.connect(websocket, "ros")
+        conn = await self.connect(websocket, "ros")
+        conn.ingest = IngestPipeline(self.vehicle_actors.dispatch, self.ingest_stats)
         await self.handle_messages(websocket, "ros")
 
     # ----------------------
@@ -197,10 +254,24 @@ class WebSocketServer:
         await websocket.close(code=4002, reason="Missing token")
         raise WebSocketDisconnect()
 
+    async def _submit_ros_message(self, websocket: WebSocket, message: dict):
+        # 只放入 ingest 佇列，不在讀取迴圈內處理
+        conn = self.connections.get(websocket)
+        if conn and conn.ingest:
+            await conn.ingest.submit(message)
+        else:
+            await self.vehicle_actors.dispatch(message)
+
     async def _handle_ros_message(self, message: dict):
 
         t = message.get("type")
 
+        # 路線座標只在這裡轉成 encoded polyline，之後推送 / 快取 / 寫入 DB 都用同一個字串
+        # 座標格式錯誤時只記錄，訊息照常處理（否則 set_ros_response 不會執行，等待中的 RPC 只能等到超時）
+        if t != "odom":
+            try: encode_route_fields(message)
+            except Exception as e: print("encode_route_fields error:", e)
+
         if t == "odom" and self.manager:
             try: await self.manager.handle_ros_odom(message)
             except Exception as e: print("handle_ros_odom error:", e)
@@ -217,24 +288,11 @@ class WebSocketServer:
             except Exception as e:
                 print("handle_ros_dispatched error:", e)
 
-            if self.ros_message_callback:
-                try:
-                    ret = self.ros_message_callback(message)
-                    if asyncio.iscoroutine(ret):
-                        asyncio.create_task(ret)
-                except Exception as e:
-                    print("ros_message_callback error:", e)
-
         elif t == "estimate" and self.manager:
             msg_id = message.get("message_id")
             try:
                 if msg_id: self.manager.set_ros_response(msg_id, message)
             except Exception as e: print("set_ros_response error:", e)
-            if self.ros_message_callback:
-                try:
-                    ret = self.ros_message_callback(message)
-                    if asyncio.iscoroutine(ret): asyncio.create_task(ret)
-                except Exception as e: print("ros_message_callback error:", e)
         
         elif t == "ready_2_trip" and self.manager:
             try: await self.manager.handle_ros_ready_to_trip(message)
@@ -254,6 +312,18 @@ class WebSocketServer:
             except Exception as e:
                 print(f"[geton] broadcast_to_web error: {e}")
             
+    async def _handle_web_message(self, websocket: WebSocket, message: dict):
+        t = message.get("type")
+
+        if t == "fleet_rate" and self.manager:
+            # 調整此 dashboard 的車隊推播頻率 (Hz)
+            self.manager.fleet_ticker.set_rate(websocket, message.get("rate_hz"))
+        elif t == "route_zoom":
+            # 調整此 dashboard 收到的路線簡化程度（地圖 zoom，null 為完整路線）
+            conn = self.connections.get(websocket)
+            if conn:
+                conn.route_zoom = clamp_zoom(message.get("zoom"))
+
     # ----------------------
     # 共用 JSON 循環
     # ----------------------
@@ -273,10 +343,11 @@ class WebSocketServer:
                     print(f"收到 {client_type} 的訊息: {message}")
 
                 if client_type == "ros":
-                    await self._handle_ros_message(message)
+                    await self._submit_ros_message(websocket, message)
                 elif client_type == "flutter":
                     await self._handle_flutter_message(message)
-                    pass
+                elif client_type == "web":
+                    await self._handle_web_message(websocket, message)
         finally:
             self.disconnect(websocket)
 
@@ -284,37 +355,108 @@ class WebSocketServer:
     # 送訊息
     # ----------------------
     async def send_json(self, websocket: WebSocket, message: dict):
-        await websocket.send_text(json.dumps(message))
+        await self.send_frame(websocket, encode_frame(message))
 
-    async def broadcast(self, message: dict, client_type: str = None):
-        if client_type:
-            conns = self.active_connections.get(client_type, [])
+    async def send_frame(self, websocket: WebSocket, frame: str):
+        conn = self.connections.get(websocket)
+        if conn:
+            conn.enqueue(frame)
         else:
-            conns = [ws for group in self.active_connections.values() for ws in group]
+            # 尚未註冊（例如驗證階段）直接送出
+            await websocket.send_text(frame)
+
+    async def broadcast(self, message: dict, client_type: str = None):
+        await self.broadcast_frame(encode_frame(message), client_type)
 
-        disconnected = []
-        for ws in conns:
-            try: await self.send_json(ws, message)
-            except WebSocketDisconnect: disconnected.append(ws)
+    async def broadcast_frame(self, frame: str, client_type: str = None, publish: bool = True):
+        """同一個已序列化的 frame 放入各連線的送出佇列，不等待實際送出"""
+        self._deliver_frame(frame, client_type)
+        if publish:
+            self.backplane.publish({"op": "broadcast", "client_type": client_type, "frame": frame})
 
-        for ws in disconnected:
-            self.disconnect(ws)
+    def _deliver_frame(self, frame: str, client_type: str = None):
+        for conn in self.connections.of_type(client_type):
+            conn.enqueue(frame)
 
     async def broadcast_to_user(self, user_id: str, message: dict):
-        ws = self.user_map.get(str(user_id))
-        if not ws:
-            print(f"Failed to send, user {user_id} offline.")
-            self.disconnect(ws)
+        await self.send_frame_to_user(user_id, encode_frame(message))
+
+    async def send_frame_to_user(self, user_id: str, frame: str, publish: bool = True):
+        conn = self.connections.for_user(user_id)
+        if not conn:
+            if publish:
+                # 不在這個 worker，交給其他 worker 嘗試送出
+                self.backplane.publish({"op": "user", "user_id": str(user_id), "frame": frame})
+            else:
+                print(f"Failed to send, user {user_id} offline.")
             return
 
-        if ws.client_state.name != "CONNECTED":
+        if conn.websocket.client_state.name != "CONNECTED":
             print(f"user {user_id} offline, remove from map")
-            self.user_map.pop(str(user_id), None)
+            self.disconnect(conn.websocket)
             return
 
-        try:
-            await self.send_json(ws, message)
-            print(f"Msg send to {user_id}: {message}")
-        except Exception as e:
-            print(f"Send error: {e}, remove user {user_id}")
-            self.user_map.pop(str(user_id), None)
+        conn.enqueue(frame)
+
+    # ----------------------
+    # 跨 worker 轉送
+    # ----------------------
+    def _on_backplane_message(self, message: dict):
+        """其他 worker 發來的訊息只送給本 worker 的連線，不再轉發"""
+        op = message.get("op")
+
+        if op == "broadcast":
+            self._deliver_frame(message["frame"], message.get("client_type"))
+        elif op == "user":
+            asyncio.create_task(self.send_frame_to_user(message["user_id"], message["frame"], publish=False))
+        elif op == "route_push" and self.manager:
+            self.manager.push_route(message["message"], publish=False)
+        elif op == "odom" and self.manager:
+            self.manager.apply_odom(message["message"])
+        elif op == "fleet_reload" and self.manager:
+            # 其他 worker 新增 / 修改了 driver
+            asyncio.create_task(self.manager.fleet_registry.load())
+        elif op == "ros_request" and self.manager:
+            # 發出請求的 worker 沒有 ROS 連線，由本 worker 送給一條 ROS 連線
+            self.manager.rpc.relay(message["frame"], message.get("correlation_id"))
+        elif op == "dispatch_status" and self.manager:
+            status = message["status"]
+            self.manager.set_dispatch_status(status["order_id"], status["state"], status["result"], publish=False)
+        elif op == "rpc_reply" and self.manager:
+            self.manager.set_ros_response(message["message_id"], message["data"], publish=False)
+        elif op == "principal_invalidate":
+            invalidate_principal(message["user_id"])
+        elif op == "place_add":
+            place_index.add(message["name"], message["lat"], message["lng"])
+
+    # ----------------------
+    # 佇列狀態
+    # ----------------------
+    def queue_stats(self) -> dict:
+        """各 client type 的連線數、送出佇列深度、降級丟棄數與被踢掉的連線數"""
+        stats = {}
+        for ctype in dict.fromkeys(("flutter", "ros", "web", *self.connections.by_type)):
+            live = self.connections.of_type(ctype)
+            depths = [c.depth() for c in live]
+            stats[ctype] = {
+                "connections": len(live),
+                "queue_depth": sum(depths),
+                "max_queue_depth": max(depths, default=0),
+                "dropped": sum(c.dropped for c in live),
+                "evicted": self.evicted.get(ctype, 0),
+            }
+        return stats
+
+    def ingest_stats_snapshot(self) -> dict:
+        """ROS 接收處理各階段（ingest 佇列 → vehicle actors）的佇列深度與處理延遲"""
+        depths = {name: 0 for name in self.ingest_stats}
+        for conn in self.connections.of_type("ros"):
+            if conn.ingest:
+                for name, depth in conn.ingest.depths().items():
+                    depths[name] += depth
+        stats = {
+            name: {"queue_depth": depths[name], **stage.snapshot()}
+            for name, stage in self.ingest_stats.items()
+        }
+        stats["actors"] = self.vehicle_actors.snapshot()
+        return stats
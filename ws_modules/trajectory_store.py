@@ -0,0 +1,192 @@
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import delete
+from database import async_engine, AsyncSessionLocal
+from models import TrajectoryPoint
+import numpy as np
+import math
+import time
+import os
+import asyncio
+
+SAMPLE_INTERVAL_SEC = float(os.getenv("TRAJECTORY_SAMPLE_SEC", "1.0"))    # 每台車最多每幾秒保留一點
+STATIONARY_HEARTBEAT_SEC = 30.0   # 靜止時仍每隔這麼久保留一點，查詢時才看得出車輛停在原地
+DEADBAND_M = 0.5                  # 與上一點距離小於此值（公尺）視為靜止
+BUFFER_CAPACITY = 600             # 每台車 ring buffer 容量（點），DB 寫不進去時最舊的點被覆蓋
+BUFFER_IDLE_SEC = 600.0           # 超過這麼久沒有 odom 且已寫完的車輛，移除其 buffer
+FLUSH_INTERVAL_SEC = 5.0
+RETENTION_HOURS = float(os.getenv("TRAJECTORY_RETENTION_HOURS", "72"))
+RETENTION_CHECK_SEC = 600.0
+COPY_COLUMNS = ("vehicle_name", "ts", "lat", "lng", "yaw")
+STAGING_TABLE = "_trajectory_load"
+
+
+class TrajectoryBuffer:
+    """單一車輛的 ring buffer：ts / lat / lng / yaw 各一個固定大小的 float64 陣列"""
+    __slots__ = ("data", "head", "size", "last", "dropped")
+
+    def __init__(self, capacity: int = BUFFER_CAPACITY):
+        self.data = np.empty((capacity, 4), dtype=np.float64)   # ts, lat, lng, yaw (NaN = 無)
+        self.head = 0        # 下一個寫入位置
+        self.size = 0
+        self.last: tuple | None = None   # 最後保留的 (ts, lat, lng)，降頻判斷用
+        self.dropped = 0
+
+    def push(self, ts: float, lat: float, lng: float, yaw: float | None):
+        capacity = len(self.data)
+        self.data[self.head] = (ts, lat, lng, math.nan if yaw is None else yaw)
+        self.head = (self.head + 1) % capacity
+        if self.size == capacity:
+            self.dropped += 1
+        else:
+            self.size += 1
+        self.last = (ts, lat, lng)
+
+    def drain(self) -> np.ndarray:
+        """依時間順序取出所有點並清空"""
+        start = (self.head - self.size) % len(self.data)
+        rows = np.roll(self.data, -start, axis=0)[:self.size].copy()
+        self.size = 0
+        return rows
+
+
+def _should_sample(last: tuple | None, ts: float, lat: float, lng: float) -> bool:
+    if last is None:
+        return True
+    last_ts, last_lat, last_lng = last
+    elapsed = ts - last_ts
+    if elapsed < SAMPLE_INTERVAL_SEC:
+        return False
+    if elapsed >= STATIONARY_HEARTBEAT_SEC:
+        return True
+    dy = (lat - last_lat) * 111320.0
+    dx = (lng - last_lng) * 111320.0 * math.cos(math.radians(lat))
+    return math.hypot(dx, dy) >= DEADBAND_M
+
+
+class TrajectoryStore:
+    """
+    車輛軌跡歷史。
+
+    odom 進來時依 SAMPLE_INTERVAL_SEC / dead-band 降頻，保留的點放進該車的 ring buffer（只寫記憶體）；
+    背景 worker 每 FLUSH_INTERVAL_SEC 取出所有 buffer，以 asyncpg COPY 寫入暫存表再
+    INSERT ... ON CONFLICT DO NOTHING 到 trajectory_points（重試時已寫入的點不會讓整批失敗），
+    並每 RETENTION_CHECK_SEC 刪除超過 RETENTION_HOURS 的資料。
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL_SEC, capacity: int = BUFFER_CAPACITY):
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.buffers: dict[str, TrajectoryBuffer] = {}   # vehicle name → buffer
+        self.retry: list[tuple] = []                     # 寫入失敗、下次重試的 records
+        self.received = 0
+        self.sampled = 0
+        self.written = 0
+        self.duplicates = 0
+        self.overwritten = 0        # 已移除的 buffer 累計被覆蓋的點數
+        self.failures = 0
+        self.purged = 0
+        self._last_purge = 0.0
+        self._lock = asyncio.Lock()
+
+    def record(self, name: str, lat: float, lng: float, yaw: float | None, ts: float | None = None):
+        if not name:
+            return
+        self.received += 1
+        ts = time.time() if ts is None else ts
+        buf = self.buffers.get(name)
+        if buf is None:
+            buf = self.buffers[name] = TrajectoryBuffer(self.capacity)
+        if not _should_sample(buf.last, ts, lat, lng):
+            return
+        buf.push(ts, lat, lng, yaw)
+        self.sampled += 1
+
+    def _drain_records(self) -> list[tuple]:
+        records = []
+        idle_before = time.time() - BUFFER_IDLE_SEC
+        for name, buf in list(self.buffers.items()):
+            if not buf.size:
+                # 已離線的車輛不再保留 buffer
+                if buf.last is None or buf.last[0] < idle_before:
+                    self.overwritten += buf.dropped
+                    del self.buffers[name]
+                continue
+            for ts, lat, lng, yaw in buf.drain().tolist():
+                records.append((
+                    name, datetime.fromtimestamp(ts, timezone.utc), lat, lng,
+                    None if math.isnan(yaw) else yaw,
+                ))
+        return records
+
+    async def flush(self):
+        async with self._lock:
+            records = self.retry + self._drain_records()
+            self.retry = []
+            if not records:
+                return
+            try:
+                inserted = await self._copy(records)
+            except Exception as e:
+                self.failures += 1
+                print("批次寫入軌跡時發生錯誤:", e)
+                # 放回去下次重試，最多保留所有 buffer 的總容量，超過丟最舊的
+                limit = self.capacity * max(len(self.buffers), 1)
+                self.retry = records[-limit:]
+                return
+            self.written += inserted
+            self.duplicates += len(records) - inserted
+
+    async def _copy(self, records: list[tuple]) -> int:
+        """
+        COPY 進暫存表後再搬到 trajectory_points，回傳實際新增的筆數。
+        上一次 COPY 其實已 commit 但沒收到回應時，重試的點會與既有資料重複，以 ON CONFLICT DO NOTHING 略過。
+        """
+        columns = ", ".join(COPY_COLUMNS)
+        async with async_engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            pg = raw.driver_connection
+            async with pg.transaction():
+                await pg.execute(
+                    f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} "
+                    f"(LIKE {TrajectoryPoint.__tablename__} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+                )
+                await pg.copy_records_to_table(STAGING_TABLE, records=records, columns=COPY_COLUMNS)
+                status = await pg.execute(
+                    f"INSERT INTO {TrajectoryPoint.__tablename__} ({columns}) "
+                    f"SELECT {columns} FROM {STAGING_TABLE} ON CONFLICT DO NOTHING"
+                )
+        return int(status.split()[-1])     # "INSERT 0 <rows>"
+
+    async def purge(self):
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=RETENTION_HOURS)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(delete(TrajectoryPoint).where(TrajectoryPoint.ts < cutoff))
+            await db.commit()
+        self.purged += result.rowcount or 0
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            now = time.monotonic()
+            if now - self._last_purge >= RETENTION_CHECK_SEC:
+                self._last_purge = now
+                try:
+                    await self.purge()
+                except Exception as e:
+                    print("刪除過期軌跡時發生錯誤:", e)
+
+    def snapshot(self) -> dict:
+        return {
+            "vehicles": len(self.buffers),
+            "buffered": sum(buf.size for buf in self.buffers.values()),
+            "retry": len(self.retry),
+            "received": self.received,
+            "sampled": self.sampled,
+            "written": self.written,
+            "duplicates": self.duplicates,
+            "overwritten": self.overwritten + sum(buf.dropped for buf in self.buffers.values()),
+            "failures": self.failures,
+            "purged": self.purged,
+            "retention_hours": RETENTION_HOURS,
+        }
@@ -0,0 +1,156 @@
+from ws_modules.ingest import StageStats, DROP_OLDEST_TYPES
+import time
+import asyncio
+
+ACTOR_MAILBOX_MAXSIZE = 256
+ACTOR_IDLE_SEC = 60.0        # 閒置超過此秒數的 actor 會自行結束並被移除
+ACTOR_DRAIN_TIMEOUT_SEC = 5.0  # 關機時最多等多久讓 actor 處理完 mailbox
+FLEET_ACTOR = "_fleet"       # 沒有車輛名稱的訊息（estimate / queued ...）共用此 actor
+_ODOM_MARKER = object()      # mailbox 中代表「處理該車最新 odom」的標記
+_STOP = object()             # mailbox 中代表「處理完前面的訊息後結束」的標記
+
+# 不同 ROS 訊息放車輛名稱的欄位不一致，依序嘗試
+VEHICLE_KEYS = ("name", "vehicle_name", "vehicle", "assigned_vehicle")
+
+
+def vehicle_key(message: dict) -> str:
+    for key in VEHICLE_KEYS:
+        value = message.get(key)
+        if value:
+            return str(value)
+    return FLEET_ACTOR
+
+
+class VehicleActor:
+    """
+    單一車輛的 mailbox + task，同一台車的訊息依序處理。
+    odom 不直接排入 mailbox：只保留最新一筆，mailbox 內最多一個標記，
+    輪到時處理當下最新的 pose，過時的 pose 不會累積。
+    """
+
+    def __init__(self, name: str, system: "VehicleActorSystem"):
+        self.name = name
+        self.system = system
+        self.mailbox: asyncio.Queue = asyncio.Queue(maxsize=ACTOR_MAILBOX_MAXSIZE)
+        self.latest_odom: tuple | None = None
+        self.odom_scheduled = False
+        self.task = asyncio.create_task(self._run())
+
+    def offer_odom(self, item: tuple):
+        if self.latest_odom is not None:
+            self.system.stats.dropped += 1
+        self.latest_odom = item
+        self._schedule_odom()
+
+    def _schedule_odom(self):
+        if self.latest_odom is not None and not self.odom_scheduled and not self.mailbox.full():
+            self.mailbox.put_nowait(_ODOM_MARKER)
+            self.odom_scheduled = True
+
+    async def _run(self):
+        while True:
+            try:
+                item = await asyncio.wait_for(self.mailbox.get(), timeout=ACTOR_IDLE_SEC)
+            except asyncio.TimeoutError:
+                # 檢查與移除之間沒有 await，不會有新訊息插進來
+                if self.mailbox.empty() and self.latest_odom is None:
+                    self.system._reap(self)
+                    return
+                continue
+
+            if item is _STOP:
+                if self.latest_odom is None:
+                    return
+                # 還有沒處理的最新 odom：先處理，下一輪再結束（剛取出一個，mailbox 一定有空位）
+                self.mailbox.put_nowait(_STOP)
+                item = _ODOM_MARKER
+
+            if item is _ODOM_MARKER:
+                self.odom_scheduled = False
+                item, self.latest_odom = self.latest_odom, None
+                if item is None:
+                    continue
+
+            enqueued_at, message, origin = item
+            started = time.monotonic()
+            try:
+                await self.system.handler(message)
+            except Exception as e:
+                print(f"[actor:{self.name}] handler error:", e)
+            done = time.monotonic()
+            self.system.stats.record(done - enqueued_at, done - started)
+            if origin is not None:
+                # 經 ingest 佇列進來的訊息：該階段的延遲算到這裡處理完成為止
+                received_at, stage_stats = origin
+                stage_stats.record(done - received_at, done - started)
+
+            # mailbox 滿時沒排進去的 odom 標記，在這裡補上
+            self._schedule_odom()
+
+
+class VehicleActorSystem:
+    """
+    每台車一個輕量 actor（asyncio task + mailbox）。
+    同一台車的訊息保持順序，不同車之間並行處理；閒置的 actor 會自動回收。
+    stop() 在關機時讓各 actor 處理完已收到的訊息再結束。
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.actors: dict[str, VehicleActor] = {}
+        self.stats = StageStats("actors")
+        self.reaped = 0
+        self.closing = False
+
+    async def dispatch(self, message: dict, received_at: float | None = None, stage_stats: StageStats | None = None):
+        """
+        received_at / stage_stats：由 ingest 佇列轉入時傳入，處理完成時把延遲記到該階段
+        """
+        if self.closing:
+            return
+        name = vehicle_key(message)
+        actor = self.actors.get(name)
+        if actor is None:
+            actor = self.actors[name] = VehicleActor(name, self)
+
+        origin = (received_at, stage_stats) if stage_stats is not None else None
+        item = (time.monotonic(), message, origin)
+        if message.get("type") in DROP_OLDEST_TYPES:
+            # odom 只保留最新一筆，不阻塞上游
+            actor.offer_odom(item)
+        else:
+            await actor.mailbox.put(item)
+
+    async def stop(self, timeout: float = ACTOR_DRAIN_TIMEOUT_SEC):
+        """不再接收新訊息，等各 actor 處理完 mailbox（最多 timeout 秒），之後仍未結束的直接取消"""
+        self.closing = True
+        actors = list(self.actors.values())
+
+        async def drain():
+            for actor in actors:
+                await actor.mailbox.put(_STOP)
+            await asyncio.gather(*(a.task for a in actors), return_exceptions=True)
+
+        try:
+            await asyncio.wait_for(drain(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[actors] {sum(not a.task.done() for a in actors)} 個 actor 未在 {timeout} 秒內處理完，直接結束")
+        for actor in actors:
+            actor.task.cancel()
+        await asyncio.gather(*(a.task for a in actors), return_exceptions=True)
+        self.actors.clear()
+
+    def _reap(self, actor: VehicleActor):
+        if self.actors.get(actor.name) is actor:
+            del self.actors[actor.name]
+            self.reaped += 1
+
+    def snapshot(self) -> dict:
+        depths = [a.mailbox.qsize() for a in self.actors.values()]
+        return {
+            "actors": len(self.actors),
+            "mailbox_depth": sum(depths),
+            "max_mailbox_depth": max(depths, default=0),
+            "reaped": self.reaped,
+            **self.stats.snapshot(),
+        }